@@ -0,0 +1,65 @@
+# Packing several report pages into one Gemini request
+import os
+
+# Pages per request when set; otherwise batches are filled up to the byte
+# budget, with at most MAX_BATCH_PAGES pages so each answer stays short
+DEFAULT_BATCH_PAGES = int(os.getenv("GEMINI_BATCH_PAGES")) if os.getenv("GEMINI_BATCH_PAGES") else None
+MAX_BATCH_PAGES = 8
+# Inline request data is capped at 20MB after base64 (4/3) encoding
+DEFAULT_BATCH_MAX_BYTES = int(os.getenv("GEMINI_BATCH_MAX_BYTES", str(12 * 1024 * 1024)))
+
+def batch_pages(pages, max_pages=None, max_bytes=None):
+    """Group (page_number, part) pairs into batches lazily
+
+    A batch is closed once it holds max_pages pages or the next page would
+    push its payload over max_bytes, so the effective batch size adapts to
+    how large the encoded pages are. Without max_pages or GEMINI_BATCH_PAGES
+    the payload budget alone decides, up to MAX_BATCH_PAGES pages. A single
+    page larger than max_bytes still goes out on its own.
+    """
+    if max_pages is None:
+        max_pages = DEFAULT_BATCH_PAGES or MAX_BATCH_PAGES
+    if max_bytes is None:
+        max_bytes = DEFAULT_BATCH_MAX_BYTES
+    max_pages = max(1, int(max_pages))
+
+    batch = []
+    batch_bytes = 0
+    for page_number, part in pages:
+        size = len(part["data"])
+        if batch and (len(batch) >= max_pages or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append((page_number, part))
+        batch_bytes += size
+    if batch:
+        yield batch
+
+def batch_prompt(prompt, page_count):
+    """Extend the single-page prompt so the model answers once per page"""
+    return f"""{prompt}
+
+        You are given {page_count} pages of the same report, each preceded by a "Page N:" label.
+        Analyze each page on its own and respond with a JSON array of {page_count} objects,
+        one per page in the order given. Each object uses the format above plus a
+        "page" field holding the page number from its label.
+        """
+
+def split_batch_response(data, page_numbers):
+    """Map a parsed batch response back onto the pages it covers"""
+    if isinstance(data, dict):
+        data = data.get("pages", [data])
+    if not isinstance(data, list):
+        raise ValueError("Batch response is not a list of page analyses")
+
+    by_page = {
+        item["page"]: item
+        for item in data
+        if isinstance(item, dict) and isinstance(item.get("page"), int)
+    }
+    if all(page_number in by_page for page_number in page_numbers):
+        return [by_page[page_number] for page_number in page_numbers]
+    if len(data) == len(page_numbers):
+        return data
+    raise ValueError(f"Expected {len(page_numbers)} page analyses, got {len(data)}")
@@ -0,0 +1,143 @@
+# Benchmark near-duplicate merging of findings on synthetic multi-page reports
+#
+#   python benchmarks/bench_dedup.py
+#   python benchmarks/bench_dedup.py --sizes 1000 5000 20000 --brute-force-max 5000
+#
+# Findings are generated from a pool of tests, each phrased several ways
+# the way different pages of one report repeat them. --kind advice instead
+# draws free-text recommendations from one shared vocabulary, so nearly
+# everything lands in one guard group and goes through LSH. For every size this
+# reports dedup.dedupe time and output size, and for sizes up to
+# --brute-force-max the same merge done by comparing every pair, as the
+# quadratic baseline and to check how many merges LSH misses.
+#
+# Before timing anything, dedupe is run on the fixed CASES below, findings in
+# English, Hindi and Gujarati as the UIs offer them, and the run stops if any
+# comes out different.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dedup import DEFAULT_THRESHOLD, guard_key, jaccard, mergeable, tokens, dedupe
+
+TESTS = [
+    "hemoglobin", "white blood cell count", "platelet count", "fasting glucose", "HbA1c", "total cholesterol",
+    "LDL cholesterol", "HDL cholesterol", "triglycerides", "creatinine", "urea", "sodium", "potassium",
+    "calcium", "vitamin D", "vitamin B12", "ferritin", "TSH", "ALT", "AST", "bilirubin", "albumin",
+    "uric acid", "CRP", "ESR"
+]
+
+PHRASINGS = [
+    "{test} is {status}",
+    "{test} level is {status}",
+    "Your {test} level is {status}",
+    "The {test} result is {status}",
+    "{test} {status}",
+    "{test} value appears {status}",
+]
+
+STATUSES = ["normal", "high", "low", "slightly high", "borderline low"]
+
+# (items, expected dedupe output)
+CASES = [
+    # Different findings that only share a number stay apart
+    (["3 महीने में रक्त परीक्षण दोहराएँ", "3 दिन तक आराम करें", "हीमोग्लोबिन 10.2 है", "प्लेटलेट 10.2 लाख"],
+     ["3 महीने में रक्त परीक्षण दोहराएँ", "3 दिन तक आराम करें", "हीमोग्लोबिन 10.2 है", "प्लेटलेट 10.2 लाख"]),
+    (["હિમોગ્લોબિન 10.2 છે", "પ્લેટલેટ 10.2 લાખ"], ["હિમોગ્લોબિન 10.2 છે", "પ્લેટલેટ 10.2 લાખ"]),
+    # One word besides the number is too little to merge on
+    (["Glucose 110", "Fasting 110"], ["Glucose 110", "Fasting 110"]),
+    (["हीमोग्लोबिन 10.2", "हीमोग्लोबिन: 10.2"], ["हीमोग्लोबिन 10.2", "हीमोग्लोबिन: 10.2"]),
+    # The same finding phrased twice still merges, in any script
+    (["हीमोग्लोबिन का स्तर कम है", "हीमोग्लोबिन का स्तर कम है।"], ["हीमोग्लोबिन का स्तर कम है।"]),
+    (["વિટામિન ડી ની ઉણપ છે", "વિટામિન ડી ની ઉણપ છે."], ["વિટામિન ડી ની ઉણપ છે."]),
+    (["Hemoglobin is low", "Your hemoglobin level is low"], ["Your hemoglobin level is low"]),
+    (["Hemoglobin is low", "Hemoglobin is high"], ["Hemoglobin is low", "Hemoglobin is high"]),
+]
+
+def check_cases():
+    for items, expected in CASES:
+        actual = dedupe(items)
+        if actual != expected:
+            raise SystemExit(f"dedupe({items!r}) returned {actual!r}, expected {expected!r}")
+
+def generate(count, seed=0):
+    rng = random.Random(seed)
+    items = []
+    for _ in range(count):
+        test = rng.choice(TESTS)
+        item = rng.choice(PHRASINGS).format(test=test, status=rng.choice(STATUSES))
+        # Some findings carry the measured value, which must not be merged away
+        if rng.random() < 0.3:
+            item += f" at {rng.randint(1, 300)}"
+        items.append(item[0].upper() + item[1:])
+    return items
+
+ADVICE_WORDS = """
+consider regular exercise diet sleep stress hydration walking swimming yoga reduce salt sugar alcohol
+smoking increase fiber fruit vegetables protein weight daily weekly meals
+""".split()
+
+def generate_advice(count, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.sample(ADVICE_WORDS, rng.randint(4, 7))).capitalize() for _ in range(count)]
+
+def brute_force(items, threshold=DEFAULT_THRESHOLD):
+    """Groups found by comparing every pair, for reference"""
+    items = list(dict.fromkeys(items))
+    token_sets = [tokens(item) for item in items]
+    guards = [guard_key(token_set) for token_set in token_sets]
+    parents = list(range(len(items)))
+
+    def find(item):
+        while parents[item] != item:
+            parents[item] = parents[parents[item]]
+            item = parents[item]
+        return item
+
+    for i in range(len(items)):
+        for j in range(i + 1, len(items)):
+            if guards[i] == guards[j] and mergeable(token_sets[i]) and mergeable(token_sets[j]) and \
+                    jaccard(token_sets[i], token_sets[j]) >= threshold:
+                parents[find(j)] = find(i)
+    return len({find(index) for index in range(len(items))})
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate merging")
+    parser.add_argument("--kind", choices=["findings", "advice"], default="findings")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 5000, 20000])
+    parser.add_argument("--brute-force-max", type=int, default=5000)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    check_cases()
+    results = []
+    print(f"{'items':>7} {'unique':>7} {'dedupe ms':>9} {'kept':>6} {'pairwise ms':>12} {'groups':>7}")
+    for size in args.sizes:
+        items = generate(size) if args.kind == "findings" else generate_advice(size)
+        unique = len(set(items))
+
+        start = time.perf_counter()
+        kept = dedupe(items, args.threshold)
+        dedupe_ms = (time.perf_counter() - start) * 1000
+
+        result = {"items": size, "unique": unique, "dedupe_ms": dedupe_ms, "kept": len(kept)}
+        if size <= args.brute_force_max:
+            start = time.perf_counter()
+            result["groups"] = brute_force(items, args.threshold)
+            result["pairwise_ms"] = (time.perf_counter() - start) * 1000
+        results.append(result)
+
+        pairwise = f"{result['pairwise_ms']:12.1f} {result['groups']:7d}" if "groups" in result else f"{'-':>12} {'-':>7}"
+        print(f"{size:7d} {unique:7d} {dedupe_ms:9.1f} {len(kept):6d} {pairwise}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
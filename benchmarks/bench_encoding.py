@@ -0,0 +1,174 @@
+# Compare page encoding profiles on a corpus of sample reports
+#
+#   python benchmarks/bench_encoding.py samples/*.pdf
+#   python benchmarks/bench_encoding.py samples/ --profiles png-300 jpeg-q85 --with-model
+#
+# For every profile this reports encode time and bytes per page, plus PSNR
+# against a 300 DPI lossless render as an offline quality proxy. With
+# --with-model each page is also analyzed by Gemini and the findings are
+# compared against the first profile's findings.
+import argparse
+import io
+import json
+import math
+import os
+import sys
+import time
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from encoding import ENCODING_PROFILES, encode_image, get_encoding_profile
+
+REFERENCE_DPI = 300
+
+def collect_pdfs(paths):
+    """Expand directories into the PDFs they contain"""
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            pdfs.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.lower().endswith(".pdf")
+            )
+        else:
+            pdfs.append(path)
+    return pdfs
+
+def render(page, dpi):
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
+    return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+def psnr(reference, encoded_part):
+    """PSNR in dB of the decoded payload against the reference, in grayscale"""
+    decoded = Image.open(io.BytesIO(encoded_part["data"])).convert("L")
+    reference = reference.convert("L").resize(decoded.size, Image.LANCZOS)
+    a = np.asarray(reference, dtype=np.float32)
+    b = np.asarray(decoded, dtype=np.float32)
+    mse = float(np.mean((a - b) ** 2))
+    if mse == 0:
+        return float("inf")
+    return 10 * math.log10(255.0 ** 2 / mse)
+
+def findings(analysis):
+    """Flatten the list fields of a page analysis into a set of lowercase words"""
+    words = set()
+    for section in ("test_results", "health_assessment", "recommendations"):
+        for value in analysis.get(section, {}).values():
+            if isinstance(value, list):
+                for item in value:
+                    words.update(str(item).lower().split())
+    return words
+
+def analyze(model, part):
+    prompt = (
+        "Extract every test name, value and unit from this medical report page. "
+        "Respond with JSON: {\"test_results\": {\"key_findings\": [...], "
+        "\"abnormal_values\": [...], \"normal_values\": [...]}}"
+    )
+    response = model.generate_content(
+        [prompt, part],
+        generation_config={"response_mime_type": "application/json", "temperature": 0}
+    )
+    return json.loads(response.text)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare page encoding profiles")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories of PDFs")
+    parser.add_argument("--profiles", nargs="+", default=list(ENCODING_PROFILES))
+    parser.add_argument("--max-pages", type=int, default=None, help="pages per document")
+    parser.add_argument("--with-model", action="store_true", help="also measure extraction agreement with Gemini")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    profiles = [get_encoding_profile(name) for name in args.profiles]
+    pdfs = collect_pdfs(args.paths)
+    if not pdfs:
+        parser.error("no PDFs found")
+
+    model = None
+    if args.with_model:
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        model = genai.GenerativeModel('gemini-1.5-flash')
+
+    stats = {
+        profile["name"]: {"pages": 0, "encode_s": 0.0, "bytes": 0, "psnr": [], "agreement": []}
+        for profile in profiles
+    }
+
+    for pdf_path in pdfs:
+        document = fitz.open(pdf_path)
+        page_count = document.page_count
+        if args.max_pages:
+            page_count = min(page_count, args.max_pages)
+
+        for page_num in range(page_count):
+            page = document[page_num]
+            reference = render(page, REFERENCE_DPI)
+            renders = {}
+            baseline = None
+
+            for profile in profiles:
+                if profile["dpi"] not in renders:
+                    renders[profile["dpi"]] = render(page, profile["dpi"])
+                image = renders[profile["dpi"]]
+
+                start = time.perf_counter()
+                part = encode_image(image, profile)
+                elapsed = time.perf_counter() - start
+
+                entry = stats[profile["name"]]
+                entry["pages"] += 1
+                entry["encode_s"] += elapsed
+                entry["bytes"] += len(part["data"])
+                entry["psnr"].append(psnr(reference, part))
+
+                if model is not None:
+                    words = findings(analyze(model, part))
+                    if baseline is None:
+                        baseline = words
+                    if baseline:
+                        entry["agreement"].append(len(words & baseline) / len(baseline))
+
+        document.close()
+
+    print(f"{len(pdfs)} documents, reference {REFERENCE_DPI} DPI lossless")
+    header = f"{'profile':<16}{'pages':>7}{'ms/page':>10}{'KiB/page':>11}{'PSNR dB':>10}"
+    if model is not None:
+        header += f"{'agreement':>11}"
+    print(header)
+
+    results = {}
+    for name, entry in stats.items():
+        pages = max(entry["pages"], 1)
+        finite = [value for value in entry["psnr"] if math.isfinite(value)]
+        results[name] = {
+            "pages": entry["pages"],
+            "encode_ms_per_page": 1000 * entry["encode_s"] / pages,
+            "bytes_per_page": entry["bytes"] / pages,
+            "psnr_db": sum(finite) / len(finite) if finite else float("inf"),
+            "agreement": (
+                sum(entry["agreement"]) / len(entry["agreement"])
+                if entry["agreement"] else None
+            )
+        }
+        row = results[name]
+        line = (
+            f"{name:<16}{row['pages']:>7}{row['encode_ms_per_page']:>10.1f}"
+            f"{row['bytes_per_page'] / 1024:>11.1f}{row['psnr_db']:>10.1f}"
+        )
+        if model is not None:
+            agreement = row["agreement"]
+            line += f"{agreement:>11.2f}" if agreement is not None else f"{'-':>11}"
+        print(line)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
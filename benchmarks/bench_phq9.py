@@ -0,0 +1,110 @@
+# Benchmark batch PHQ-9 scoring against scoring one respondent at a time
+#
+#   python benchmarks/bench_phq9.py
+#   python benchmarks/bench_phq9.py --sizes 10000 100000 --json phq9.json
+#
+# For every size, random questionnaires are scored three ways: the former
+# per-respondent loop (sum, then a search through a dict of ranges),
+# model.score_batch on the N x 9 matrix, and model.score_csv reading and
+# writing CSV files, the path a screening export goes through. Batch results
+# are checked against the loop's.
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model import QUESTION_COLUMNS, score_batch, score_csv
+
+SEVERITY_RANGES = {
+    range(0, 5): "Minimal depression",
+    range(5, 10): "Mild depression",
+    range(10, 15): "Moderate depression",
+    range(15, 20): "Moderately severe depression",
+    range(20, 28): "Severe depression"
+}
+
+def score_one(responses):
+    """calculate_score as it was before batch scoring, for reference"""
+    total_score = sum(responses)
+    severity = None
+    for score_range, level in SEVERITY_RANGES.items():
+        if total_score in score_range:
+            severity = level
+    count_of_threes = sum(1 for score in responses if score == 3)
+    has_core_symptoms = responses[0] == 3 or responses[1] == 3
+    return (
+        total_score,
+        severity,
+        count_of_threes >= 5 and has_core_symptoms,
+        (2 <= count_of_threes <= 4) and has_core_symptoms
+    )
+
+def generate(count, seed=0):
+    """Respondents leaning to low scores, with a tail of severe cases"""
+    rng = np.random.default_rng(seed)
+    severity = rng.beta(1.2, 3.0, size=(count, 1))
+    return np.clip(np.round(rng.normal(severity * 3, 0.7, size=(count, len(QUESTION_COLUMNS)))), 0, 3).astype(np.int8)
+
+def write_input(path, responses, seed=0):
+    difficulty = np.random.default_rng(seed + 1).integers(0, 4, size=len(responses))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(",".join(["id"] + QUESTION_COLUMNS + ["difficulty"]) + "\n")
+        for index, (row, level) in enumerate(zip(responses.tolist(), difficulty.tolist()), 1):
+            f.write(f"R{index}," + ",".join(map(str, row)) + f",{level}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch PHQ-9 scoring")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'rows':>7} {'loop ms':>9} {'batch ms':>9} {'speedup':>8} {'csv ms':>8} {'csv rows/s':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            responses = generate(size)
+            rows = responses.tolist()
+
+            start = time.perf_counter()
+            expected = [score_one(row) for row in rows]
+            loop_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            scores = score_batch(responses)
+            batch_ms = (time.perf_counter() - start) * 1000
+
+            actual = list(zip(
+                scores["total_score"].tolist(),
+                scores["severity"].tolist(),
+                scores["potential_major_depression"].tolist(),
+                scores["potential_other_depression"].tolist()
+            ))
+            if actual != expected:
+                mismatches = sum(1 for first, second in zip(actual, expected) if first != second)
+                raise SystemExit(f"score_batch disagrees with the per-respondent loop on {mismatches} of {size} rows")
+
+            input_path = os.path.join(directory, f"phq9-{size}.csv")
+            output_path = os.path.join(directory, f"phq9-{size}-scores.csv")
+            write_input(input_path, responses)
+            start = time.perf_counter()
+            score_csv(input_path, output_path)
+            csv_ms = (time.perf_counter() - start) * 1000
+
+            results.append({
+                "rows": size, "loop_ms": loop_ms, "batch_ms": batch_ms, "csv_ms": csv_ms,
+                "csv_rows_per_second": size / (csv_ms / 1000)
+            })
+            print(f"{size:7d} {loop_ms:9.1f} {batch_ms:9.2f} {loop_ms / batch_ms:7.0f}x {csv_ms:8.1f} "
+                  f"{size / (csv_ms / 1000):11.0f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+# End-to-end benchmark of the report pipeline against a local Gemini stand-in
+#
+#   python benchmarks/bench_pipeline.py
+#   python benchmarks/bench_pipeline.py --pages 5 30 --scanned 0 1 --paths views --latency-ms 1500
+#   python benchmarks/bench_pipeline.py --baseline benchmarks/results/pipeline-20240101-120000.json
+#
+# Synthetic PDFs (lab result tables, as real text or as scanned images) are
+# run through pdf rendering -> get_gemini_response -> combine_analyses for
+# the PyMuPDF path in views.py and the pdf2image path in final_whole.py.
+# FakeGenerativeModel answers in the page analysis format after a
+# configurable latency, with jitter, injected quota errors and malformed
+# output, so no API key is needed.
+#
+# Every case runs in a fresh process so peak RSS is its own. Stage times are
+# busy time: the stages overlap, so they add up to more than the wall time.
+# Results are written to benchmarks/results/ and, with --baseline, compared
+# against an earlier run.
+import argparse
+import importlib
+import itertools
+import json
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+TESTS = [
+    ("Hemoglobin", "g/dL", 11.5, 17.0), ("White blood cells", "10^3/uL", 4.0, 11.0),
+    ("Platelets", "10^3/uL", 150, 450), ("Fasting glucose", "mg/dL", 70, 100),
+    ("HbA1c", "%", 4.0, 5.6), ("Total cholesterol", "mg/dL", 120, 200),
+    ("LDL cholesterol", "mg/dL", 50, 130), ("HDL cholesterol", "mg/dL", 40, 80),
+    ("Triglycerides", "mg/dL", 50, 150), ("Creatinine", "mg/dL", 0.6, 1.3),
+    ("Sodium", "mmol/L", 135, 145), ("Potassium", "mmol/L", 3.5, 5.1),
+    ("Vitamin D", "ng/mL", 30, 100), ("TSH", "mIU/L", 0.4, 4.0), ("ALT", "U/L", 7, 56),
+]
+
+class FakeQuotaError(Exception):
+    """Looks like google.api_core's ResourceExhausted to rate_limit"""
+    code = 429
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeGenerativeModel:
+    """Stands in for genai.GenerativeModel in the report pipeline
+
+    Each call sleeps latency + jitter + upload time for the bytes sent, then
+    answers with one analysis per page in the request (a JSON array for
+    batches) or, for reduce prompts, a status and summary.
+    """
+
+    def __init__(self, latency_ms=800, jitter_ms=200, error_rate=0.0, malformed_rate=0.0,
+                 ms_per_mb=200, seed=0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.seconds_per_byte = ms_per_mb / 1000 / (1024 * 1024)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0, "malformed": 0, "bytes_sent": 0, "busy_s": 0.0}
+
+    def _roll(self):
+        with self._lock:
+            return self._random.random(), self._random.random(), self._random.gauss(0, 1)
+
+    def generate_content(self, contents, generation_config=None, stream=False):
+        start = time.perf_counter()
+        parts = contents if isinstance(contents, list) else [contents]
+        sent = sum(len(part["data"]) if isinstance(part, dict) else len(part.encode("utf-8")) for part in parts)
+        error_roll, malformed_roll, jitter = self._roll()
+        time.sleep(max(0.0, self.latency + jitter * self.jitter + sent * self.seconds_per_byte))
+
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["bytes_sent"] += sent
+            self.stats["busy_s"] += time.perf_counter() - start
+            if error_roll < self.error_rate:
+                self.stats["errors"] += 1
+                raise FakeQuotaError("429 Resource has been exhausted (fake)")
+
+        text = self._answer(parts)
+        if malformed_roll < self.malformed_rate:
+            with self._lock:
+                self.stats["malformed"] += 1
+            text = f"Here is the analysis you asked for:\n```json\n{text}\n```\nLet me know if you need more."
+        return FakeResponse(text)
+
+    async def generate_content_async(self, contents, generation_config=None):
+        import asyncio
+        return await asyncio.to_thread(self.generate_content, contents, generation_config)
+
+    def _answer(self, parts):
+        if isinstance(parts[0], str) and "Part 1:" in parts[0]:
+            return json.dumps({
+                "overall_status": "Mostly healthy with a few results outside the normal range.",
+                "summary": "Most results are normal. A few values need follow-up with your doctor."
+            })
+
+        labels = [int(m) for part in parts if isinstance(part, str) for m in re.findall(r"^Page (\d+):", part)]
+        pages = max(1, sum(
+            1 for part in parts
+            if isinstance(part, dict) or (isinstance(part, str) and part.startswith("Report page text"))
+        ))
+        analyses = [self._page(labels[index] if index < len(labels) else index + 1) for index in range(pages)]
+        if pages == 1:
+            return json.dumps(analyses[0])
+        return json.dumps(analyses)
+
+    def _page(self, page_number):
+        rng = random.Random(page_number)
+        tests = rng.sample(TESTS, 5)
+        findings = [f"{name} is within the normal range" for name, _, _, _ in tests[:3]]
+        abnormal = [f"{name} is slightly high" for name, _, _, _ in tests[3:]]
+        return {
+            "page": page_number,
+            "test_results": {"key_findings": findings, "abnormal_values": abnormal, "normal_values": findings[:2]},
+            "health_assessment": {
+                "overall_status": "Generally healthy",
+                "areas_of_concern": abnormal,
+                "positive_indicators": findings[:1]
+            },
+            "recommendations": {
+                "immediate_actions": [],
+                "follow_up_tests": [f"Repeat {tests[3][0]} in 3 months"],
+                "lifestyle_changes": ["Eat a balanced diet", "Exercise regularly"]
+            },
+            "summary": f"Page {page_number} shows mostly normal results."
+        }
+
+def lab_lines(rng, count):
+    lines = ["LABORATORY REPORT", f"Patient ID: {rng.randint(10000, 99999)}", ""]
+    lines.append(f"{'Test':28}{'Result':>10}  {'Unit':10}{'Reference':>16}")
+    for _ in range(count):
+        name, unit, low, high = rng.choice(TESTS)
+        value = round(rng.uniform(low * 0.8, high * 1.2), 1)
+        lines.append(f"{name:28}{value:>10}  {unit:10}{f'{low} - {high}':>16}")
+    return lines
+
+def make_pdf(pages, scanned_ratio, seed=0, scan_dpi=150):
+    """Synthetic lab report; scanned pages carry only an image of the text"""
+    import fitz  # PyMuPDF
+
+    rng = random.Random(seed)
+    document = fitz.open()
+    for _ in range(pages):
+        page = document.new_page(width=595, height=842)
+        text = "\n".join(lab_lines(rng, rng.randint(20, 40)))
+        if rng.random() < scanned_ratio:
+            scratch = fitz.open()
+            scratch_page = scratch.new_page(width=595, height=842)
+            scratch_page.insert_text((40, 50), text, fontname="cour", fontsize=9)
+            pix = scratch_page.get_pixmap(dpi=scan_dpi, colorspace=fitz.csGRAY)
+            page.insert_image(page.rect, stream=pix.tobytes("png"))
+            scratch.close()
+        else:
+            page.insert_text((40, 50), text, fontname="cour", fontsize=9)
+    data = document.tobytes(garbage=3, deflate=True)
+    document.close()
+    return data
+
+class StageTimer:
+    """Busy time spent pulling items through wrapped iterators and calls"""
+
+    def __init__(self):
+        self.seconds = {}
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def iterate(self, stage, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - start)
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+def load_pipeline(path, cache_dir, raster_workers):
+    """Import views.py (as its Django app package) or final_whole.py"""
+    if path == "streamlit":
+        return importlib.import_module("final_whole")
+
+    import django
+    from django.conf import settings
+    settings.configure(
+        REPORT_CACHE_DIR=cache_dir,
+        REPORT_JOBS_DB=os.path.join(cache_dir, "jobs.sqlite3"),
+        REPORT_RASTER_WORKERS=raster_workers,
+        GEMINI_WARM_UP=False
+    )
+    django.setup()
+    sys.path.insert(0, os.path.dirname(REPO_ROOT))
+    return importlib.import_module(f"{os.path.basename(REPO_ROOT)}.views")
+
+def run_case(case, options):
+    """Run one (path, pdf) case; called in a fresh process"""
+    from rate_limit import AdaptiveConcurrency, LimitedModel, ModelLimiter, TokenBucket
+    from report_cache import ReportCache
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        module = load_pipeline(case["path"], cache_dir, options["raster_workers"])
+        # Fresh caches, so every page really goes to the model
+        for name in ("report_cache", "page_cache", "reduce_cache"):
+            setattr(module, name, ReportCache(os.path.join(cache_dir, name)))
+
+        with open(case["pdf"], "rb") as f:
+            pdf_bytes = f.read()
+
+        fake = FakeGenerativeModel(
+            options["latency_ms"], options["jitter_ms"], options["error_rate"],
+            options["malformed_rate"], options["ms_per_mb"], seed=options["seed"]
+        )
+        limiter = ModelLimiter(
+            bucket=TokenBucket(rate=0),
+            concurrency=AdaptiveConcurrency(max_limit=options["max_in_flight"]),
+            backoff_base=0.05
+        )
+        model = LimitedModel(fake, limiter)
+
+        timer = StageTimer()
+        encode_images = module.encode_images
+
+        def timed_encode(images, profile=None):
+            # Time spent in here includes pulling pages from the renderer
+            return timer.iterate("render+encode", encode_images(images, profile))
+
+        module.encode_images = timed_encode
+        module.combine_analyses = timer.wrap("combine", module.combine_analyses)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        if case["path"] == "views":
+            pages = module.iter_pdf_pages(
+                pdf_bytes,
+                dpi=module.ENCODING_PROFILE["dpi"],
+                text_layer=module.USE_TEXT_LAYER,
+                workers=module.RASTER_WORKERS
+            )
+        else:
+            pages = module.iter_pdf_pages(pdf_bytes, dpi=module.ENCODING_PROFILE["dpi"])
+        pages = timer.iterate("render", pages)
+        analysis = module.get_gemini_response(
+            model, pages, "English",
+            max_in_flight=options["max_in_flight"],
+            profile=module.ENCODING_PROFILE,
+            batch_size=options["batch_size"]
+        )
+        wall = time.perf_counter() - start
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    render = timer.seconds.get("render", 0.0)
+    limiter_stats = limiter.stats()
+    return {
+        **{key: case[key] for key in ("path", "pages", "scanned", "pdf_bytes")},
+        "wall_s": wall,
+        "pages_per_s": case["pages"] / wall,
+        "stages_s": {
+            "render": render,
+            "encode": timer.seconds.get("render+encode", 0.0) - render,
+            "model": fake.stats["busy_s"],
+            "combine": timer.seconds.get("combine", 0.0)
+        },
+        "model_calls": fake.stats["calls"],
+        "bytes_sent": fake.stats["bytes_sent"],
+        "injected_errors": fake.stats["errors"],
+        "malformed": fake.stats["malformed"],
+        "retried": limiter_stats["retried"],
+        "failed_pages": len(analysis["failed_pages"]) if analysis else None,
+        # ru_maxrss is in KiB on Linux; worker processes are not included
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_traced_mb": traced_peak / (1024 * 1024)
+    }
+
+def case_key(result):
+    return f"{result['path']}/{result['pages']}p/{result['scanned']:.0%} scanned"
+
+COMPARED = [("wall_s", True), ("pages_per_s", False), ("bytes_sent", True), ("peak_rss_mb", True)]
+
+def compare(results, baseline_path, tolerance):
+    """Print changes against an earlier run; higher is worse unless noted"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {case_key(result): result for result in json.load(f)["results"]}
+
+    regressions = 0
+    print(f"\nAgainst {baseline_path}:")
+    for result in results:
+        before = baseline.get(case_key(result))
+        if before is None:
+            continue
+        changes = []
+        for metric, lower_is_better in COMPARED:
+            if not before.get(metric):
+                continue
+            change = (result[metric] - before[metric]) / before[metric]
+            worse = change > tolerance if lower_is_better else change < -tolerance
+            regressions += worse
+            changes.append(f"{metric} {change:+.0%}{' REGRESSION' if worse else ''}")
+        print(f"  {case_key(result):28} {', '.join(changes)}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the report pipeline with a fake Gemini model")
+    parser.add_argument("--paths", nargs="+", choices=["views", "streamlit"], default=["views", "streamlit"])
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 20, 60])
+    parser.add_argument("--scanned", type=float, nargs="+", default=[0.0, 1.0], help="share of image-only pages")
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--ms-per-mb", type=float, default=200, help="upload time the fake model adds")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="share of calls failing with a 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.05, help="share of answers wrapped in prose")
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--raster-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="results file, default benchmarks/results/pipeline-<time>.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    options = {
+        "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "ms_per_mb": args.ms_per_mb,
+        "error_rate": args.error_rate, "malformed_rate": args.malformed_rate,
+        "max_in_flight": args.max_in_flight, "batch_size": args.batch_size,
+        "raster_workers": args.raster_workers, "seed": args.seed
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as pdf_dir:
+        print(f"{'case':28} {'wall s':>7} {'pages/s':>8} {'render':>7} {'encode':>7} {'model':>7} "
+              f"{'combine':>7} {'MB sent':>8} {'RSS MB':>7} {'failed':>6}")
+        for pages, scanned in itertools.product(args.pages, args.scanned):
+            pdf_path = os.path.join(pdf_dir, f"report-{pages}-{scanned}.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(make_pdf(pages, scanned, seed=args.seed))
+
+            for path in args.paths:
+                case = {
+                    "path": path, "pages": pages, "scanned": scanned,
+                    "pdf": pdf_path, "pdf_bytes": os.path.getsize(pdf_path)
+                }
+                # A fresh process per case keeps imports, caches and peak RSS separate
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                    result = executor.submit(run_case, case, options).result()
+                results.append(result)
+
+                stages = result["stages_s"]
+                print(
+                    f"{case_key(result):28} {result['wall_s']:7.2f} {result['pages_per_s']:8.2f} "
+                    f"{stages['render']:7.2f} {stages['encode']:7.2f} {stages['model']:7.2f} "
+                    f"{stages['combine']:7.2f} {result['bytes_sent'] / 1e6:8.2f} "
+                    f"{result['peak_rss_mb']:7.0f} {result['failed_pages']:6}"
+                )
+
+    out = args.out or os.path.join(RESULTS_DIR, f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"options": options, "results": results}, f, indent=2)
+    print(f"\nResults written to {out}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Measure how many malformed page analyses are recovered without another model call
+#
+#   python benchmarks/bench_report_parsing.py
+#   python benchmarks/bench_report_parsing.py --corpus captured.jsonl --json results.json
+#
+# The corpus holds one {"case": ..., "text": ..., "recoverable": true/false}
+# object per line: raw model output and whether it contains a usable page
+# analysis. The old json.loads + "```json" stripping parser and
+# report_schema.parse_page are both run over it; a case counts as
+# recovered if the parser returns an analysis, and as a false accept if it
+# returns one for an unrecoverable case.
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from report_schema import parse_page
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "malformed_page_outputs.jsonl")
+
+def legacy_parse(text):
+    """The parser get_gemini_response used before report_schema"""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        cleaned_response = text.strip()
+        if cleaned_response.startswith("```json"):
+            cleaned_response = cleaned_response[7:-3]
+        return json.loads(cleaned_response)
+
+def load_corpus(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def run(parser, corpus, repeat):
+    outcomes = {}
+    for case in corpus:
+        try:
+            parsed = parser(case["text"])
+            outcomes[case["case"]] = isinstance(parsed, dict)
+        except Exception:
+            outcomes[case["case"]] = False
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for case in corpus:
+            try:
+                parser(case["text"])
+            except Exception:
+                pass
+    latency_us = (time.perf_counter() - start) / (repeat * len(corpus)) * 1e6
+
+    recoverable = [case for case in corpus if case["recoverable"]]
+    return {
+        "recovered": sum(1 for case in recoverable if outcomes[case["case"]]),
+        "recoverable": len(recoverable),
+        "false_accepts": [case["case"] for case in corpus if not case["recoverable"] and outcomes[case["case"]]],
+        "lost": [case["case"] for case in recoverable if not outcomes[case["case"]]],
+        "latency_us": latency_us
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark page analysis parsing on malformed outputs")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=200, help="timing passes over the corpus")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    results = {
+        "legacy": run(legacy_parse, corpus, args.repeat),
+        "report_schema": run(parse_page, corpus, args.repeat)
+    }
+
+    print(f"{len(corpus)} cases from {args.corpus}")
+    for name, result in results.items():
+        print(
+            f"{name:14} recovered {result['recovered']}/{result['recoverable']}"
+            f"  false accepts {len(result['false_accepts'])}"
+            f"  {result['latency_us']:8.1f} us/case"
+        )
+        for case in result["lost"]:
+            print(f"  lost: {case}")
+        for case in result["false_accepts"]:
+            print(f"  false accept: {case}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# Measure the off-topic pre-filter on a labeled sample of chat messages
+#
+#   python benchmarks/bench_topic_filter.py
+#   python benchmarks/bench_topic_filter.py --samples labeled.jsonl --min-signals 3
+#
+# Reports latency per message and, for the refusals, precision (refused
+# messages that really were off-topic) and recall (off-topic messages that
+# never reached the model). Medical messages refused by mistake are listed,
+# as those are the expensive errors. Besides messages written for each side,
+# the default sample holds hard cases: emergencies told through everyday
+# words (cars, matches, restaurants) that a word-list filter is prone to
+# refuse. A samples file holds one
+# {"text": ..., "off_topic": true/false} object per line.
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from topic_filter import DEFAULT_MIN_SIGNALS, is_off_topic
+
+MEDICAL = [
+    "How do I treat a burn from boiling water?",
+    "my son cut his finger and it won't stop bleeding",
+    "what should I do if someone is choking",
+    "I have a terrible headache and feel dizzy",
+    "bee sting on my arm is swelling up",
+    "is it safe to take ibuprofen with paracetamol",
+    "my friend passed out at the party",
+    "I think I sprained my ankle playing football",
+    "how to stop a nosebleed",
+    "child has a fever of 39 degrees",
+    "I got hit in the head and now I feel sick",
+    "chest pain when breathing in",
+    "what is the dose of paracetamol for a toddler",
+    "my dog bit me, do I need a tetanus shot",
+    "I feel anxious all the time and can't sleep",
+    "how do I know if a bone is broken",
+    "allergic reaction to peanuts what do I do",
+    "can't breathe properly after running",
+    "rash all over my back after a new soap",
+    "food poisoning symptoms",
+    "how long should I keep ice on a bruise",
+    "someone collapsed and is not breathing",
+    "my eye is red and itchy",
+    "I accidentally swallowed some bleach",
+    "grandma fell and her hip hurts",
+    "stomach cramps and diarrhea since yesterday",
+    "how to do CPR on a baby",
+    "sunburn blisters on my shoulders",
+    "should I go to the hospital for a deep cut",
+    "splinter stuck under my fingernail",
+]
+
+OFF_TOPIC = [
+    "what's the weather like in London tomorrow",
+    "who won the football match last night",
+    "write a poem about the sea",
+    "what is the capital of Australia",
+    "recommend a good movie on netflix",
+    "how do I fix this python error",
+    "should I buy bitcoin now",
+    "tell me a joke",
+    "translate hello into french",
+    "help me with my math homework",
+    "what is the best recipe for chocolate cake",
+    "how much is an iphone 15",
+    "who is the president of the united states",
+    "book me a flight to paris",
+    "what are the lyrics to bohemian rhapsody",
+    "how do I write a resume for a software job",
+    "explain the history of the roman empire",
+    "best laptop for gaming under 1000",
+    "how many planets are in the solar system",
+    "what is the population of india",
+]
+
+# Medical messages full of off-topic words; refusing any of these is the costly mistake
+HARD_MEDICAL = [
+    "my friend was hit by a car and isn't moving",
+    "what should I do after a car accident?",
+    "I fell off my bike",
+    "my dad collapsed at the restaurant",
+    "someone collapsed during the football match",
+    "my kid swallowed a chess piece",
+    "I got stung by a wasp on holiday",
+    "car crash on the motorway, the driver is trapped",
+    "a player got hurt at the tennis tournament",
+    "my son fell during the basketball game and can't get up",
+    "I burned myself while I was cooking dinner",
+    "someone at the hotel pool is unresponsive",
+    "my laptop charger gave me an electric shock",
+    "what do I do if someone is drowning",
+]
+
+# Short follow-ups without evidence either way must still reach the model
+AMBIGUOUS = [
+    "what about the second one?",
+    "thanks",
+    "can you explain that again",
+    "yes",
+    "and if it gets worse?",
+]
+
+def default_samples():
+    samples = [{"text": text, "off_topic": False} for text in MEDICAL + HARD_MEDICAL + AMBIGUOUS]
+    samples += [{"text": text, "off_topic": True} for text in OFF_TOPIC]
+    return samples
+
+def load_samples(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the off-topic pre-filter")
+    parser.add_argument("--samples", help="JSONL file of labeled messages")
+    parser.add_argument("--min-signals", type=int, default=DEFAULT_MIN_SIGNALS,
+                        help="distinct off-topic words needed to refuse without an off-topic phrase")
+    parser.add_argument("--repeat", type=int, default=200, help="timing passes over the sample")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples) if args.samples else default_samples()
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for sample in samples:
+            is_off_topic(sample["text"], args.min_signals)
+    per_message_us = (time.perf_counter() - start) / (args.repeat * len(samples)) * 1e6
+
+    refused = [sample for sample in samples if is_off_topic(sample["text"], args.min_signals)]
+    true_refusals = sum(1 for sample in refused if sample["off_topic"])
+    off_topic_total = sum(1 for sample in samples if sample["off_topic"])
+    wrongly_refused = [sample["text"] for sample in refused if not sample["off_topic"]]
+    missed = [
+        sample["text"] for sample in samples
+        if sample["off_topic"] and sample not in refused
+    ]
+
+    results = {
+        "samples": len(samples),
+        "min_signals": args.min_signals,
+        "latency_us": per_message_us,
+        "refused": len(refused),
+        "precision": true_refusals / len(refused) if refused else None,
+        "recall": true_refusals / off_topic_total if off_topic_total else None,
+        "wrongly_refused": wrongly_refused,
+        "sent_to_model": missed
+    }
+
+    print(f"{len(samples)} messages, min signals {args.min_signals}")
+    print(f"latency   {per_message_us:8.1f} us/message")
+    if results["precision"] is not None:
+        print(f"precision {results['precision']:8.1%}  ({true_refusals}/{len(refused)} refusals off-topic)")
+    if results["recall"] is not None:
+        print(f"recall    {results['recall']:8.1%}  ({true_refusals}/{off_topic_total} off-topic refused)")
+    for text in wrongly_refused:
+        print(f"  wrongly refused: {text}")
+    for text in missed:
+        print(f"  sent to model:   {text}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
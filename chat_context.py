@@ -0,0 +1,70 @@
+# Token-budgeted conversation context with a rolling summary of older turns
+import os
+
+DEFAULT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "1500"))
+DEFAULT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+
+SUMMARY_PROMPT = """
+You maintain a running summary of a conversation between a patient and a medical first aid assistant.
+Update the summary with the new messages below. Keep the patient's symptoms, relevant history,
+advice already given and any emergencies mentioned. Drop small talk. Answer with the summary only,
+in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+"""
+
+def estimate_tokens(text):
+    """Rough token count, about four characters per token for Gemini"""
+    return (len(text) + 3) // 4
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to roughly max_tokens tokens"""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max(max_chars - 3, 0)] + "..."
+
+def format_message(message):
+    speaker = 'User' if message['role'] == 'user' else 'Assistant'
+    return f"{speaker}: {message['content']}"
+
+def select_recent(messages, budget):
+    """Most recent messages whose formatted text fits in budget tokens, oldest first
+
+    The newest message is always kept, truncated if it alone is over budget.
+    """
+    selected = []
+    used = 0
+    for message in reversed(messages):
+        line = format_message(message)
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            if not selected:
+                selected.append(dict(message, content=truncate_to_tokens(message['content'], budget)))
+            break
+        selected.append(message)
+        used += cost
+    selected.reverse()
+    return selected
+
+def format_context(messages, summary=""):
+    """Render the summary and recent messages as the prompt's context block"""
+    lines = []
+    if summary:
+        lines.append(f"Summary of the earlier conversation: {summary}")
+    lines.extend(format_message(message) for message in messages)
+    return "\n".join(lines)
+
+def update_summary(model, summary, messages, max_tokens=DEFAULT_SUMMARY_TOKENS):
+    """Fold messages into the running summary with one model call"""
+    prompt = SUMMARY_PROMPT.format(
+        max_words=max(max_tokens * 3 // 4, 20),
+        summary=summary or "(empty)",
+        messages="\n".join(format_message(message) for message in messages)
+    )
+    response = model.generate_content(prompt)
+    return truncate_to_tokens(response.text.strip(), max_tokens)
@@ -0,0 +1,328 @@
+# Append-only JSONL chat history with an offset index and background compaction
+import json
+import os
+import tempfile
+import threading
+
+CLEAR_MARKER = {"type": "clear"}
+OFFSET_SIZE = 8
+
+class ChatLog:
+    """Chat messages stored one JSON record per line
+
+    Appending a message writes a single line, so a turn costs O(1) however
+    long the conversation is. A sidecar index (<path>.idx) holds the byte
+    offset of every live message as a fixed-width integer, so message k is
+    found with one seek and any range of messages can be read without
+    touching the rest of the log.
+
+    Clearing appends a marker and truncates the index instead of rewriting
+    the log. A background compaction later rewrites the live messages
+    (capped at max_messages) into a new log and index and swaps them in.
+
+    Clearing and compaction drop messages from the front, which moves every
+    later message to a lower position. base counts the messages dropped
+    since the log was opened, so a position taken earlier can be rebased:
+    live message k was message k + base at the time.
+
+    A rolling summary of older messages can be cached next to the log
+    (<path>.summary.json) so it survives restarts and is not recomputed.
+    """
+
+    def __init__(self, path="chat_history.jsonl", legacy_path="chat_history.json",
+                 compact_every=200, max_messages=None, fsync=True):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.summary_path = path + ".summary.json"
+        self.compact_every = compact_every
+        self.max_messages = max_messages
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self.base = 0
+        self._appends_since_compaction = 0
+        self._needs_compaction = False
+        self._compacting = False
+
+        if not os.path.exists(path) and legacy_path and os.path.exists(legacy_path):
+            self._migrate(legacy_path)
+        self._sync_index()
+
+    def _migrate(self, legacy_path):
+        """Convert an old chat_history.json array into the log once"""
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                history = json.load(f) if os.path.getsize(legacy_path) > 0 else []
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Error migrating chat history: {e}")
+            return
+        self._rewrite(history)
+
+    def _log_size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def _read_offsets(self, start, stop):
+        with open(self.index_path, 'rb') as f:
+            f.seek(start * OFFSET_SIZE)
+            data = f.read((stop - start) * OFFSET_SIZE)
+        return [
+            int.from_bytes(data[i:i + OFFSET_SIZE], "big")
+            for i in range(0, len(data), OFFSET_SIZE)
+        ]
+
+    def _sync_index(self):
+        """Bring the index up to date after a crash between log and index writes"""
+        with self._lock:
+            try:
+                index_size = os.path.getsize(self.index_path)
+            except FileNotFoundError:
+                index_size = None
+
+            log_size = self._log_size()
+            if index_size is None or index_size % OFFSET_SIZE:
+                self._rebuild_index()
+                return
+
+            count = index_size // OFFSET_SIZE
+            start = self._read_offsets(count - 1, count)[0] if count else 0
+            if count and not self._is_record_start(start, log_size):
+                self._rebuild_index()
+                return
+
+            # Index any complete records logged after the last indexed one
+            offsets = []
+            cleared = False
+            for offset, record in self._scan(start):
+                if count and offset == start:
+                    continue
+                if record == CLEAR_MARKER:
+                    offsets = []
+                    cleared = True
+                else:
+                    offsets.append(offset)
+            if cleared:
+                self._write_index(offsets)
+            elif offsets:
+                self._append_offsets(offsets)
+
+    def _is_record_start(self, offset, log_size):
+        """Whether a message record begins at offset, i.e. the index matches the log"""
+        if offset >= log_size:
+            return False
+        with open(self.path, 'rb') as f:
+            if offset:
+                f.seek(offset - 1)
+                if f.read(1) != b"\n":
+                    return False
+            else:
+                f.seek(0)
+            line = f.readline()
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return False
+        return isinstance(record, dict) and record != CLEAR_MARKER
+
+    def _rebuild_index(self):
+        offsets = []
+        for offset, record in self._scan(0):
+            if record == CLEAR_MARKER:
+                offsets = []
+            else:
+                offsets.append(offset)
+        self._write_index(offsets)
+
+    def _scan(self, start):
+        """Yield (offset, record) for every complete record from start onwards"""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if line.endswith(b"\n") and line.strip():
+                    try:
+                        yield offset, json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash
+                        pass
+                offset += len(line)
+
+    def _write_index(self, offsets):
+        with open(self.index_path, 'wb') as f:
+            f.write(b"".join(offset.to_bytes(OFFSET_SIZE, "big") for offset in offsets))
+
+    def _append_offsets(self, offsets):
+        with open(self.index_path, 'ab') as f:
+            f.write(b"".join(offset.to_bytes(OFFSET_SIZE, "big") for offset in offsets))
+
+    def _write_record(self, record):
+        """Append one line to the log and return the offset it starts at"""
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                # A crash mid-append leaves a torn last line; terminate it so
+                # the new record starts on a line of its own
+                if offset and not self._ends_with_newline():
+                    line = b"\n" + line
+                    offset += 1
+                f.write(line)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            return offset
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def append(self, message):
+        """Persist one message"""
+        with self._lock:
+            offset = self._write_record(message)
+            self._append_offsets([offset])
+            self._appends_since_compaction += 1
+            if self.compact_every and self._appends_since_compaction >= self.compact_every:
+                self._needs_compaction = True
+        self._maybe_compact()
+
+    def clear(self):
+        """Forget every message logged so far"""
+        with self._lock:
+            self._write_record(CLEAR_MARKER)
+            self.base += self.count()
+            self._write_index([])
+            if os.path.exists(self.summary_path):
+                os.remove(self.summary_path)
+            self._needs_compaction = True
+        self._maybe_compact()
+
+    def count(self):
+        """Number of live messages"""
+        try:
+            return os.path.getsize(self.index_path) // OFFSET_SIZE
+        except FileNotFoundError:
+            return 0
+
+    def read(self, start, stop):
+        """Return live messages start..stop-1, oldest first"""
+        with self._lock:
+            count = self.count()
+            start, stop = max(0, start), min(stop, count)
+            if start >= stop:
+                return []
+
+            offsets = self._read_offsets(start, stop + 1 if stop < count else stop)
+            begin = offsets[0]
+            end = offsets[stop - start] if stop < count else self._log_size()
+            with open(self.path, 'rb') as f:
+                f.seek(begin)
+                data = f.read(end - begin)
+
+        messages = []
+        for line in data.split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record != CLEAR_MARKER:
+                messages.append(record)
+        return messages
+
+    def tail(self, limit):
+        """Return up to the last limit live messages, oldest first"""
+        with self._lock:
+            count = self.count()
+            return self.read(count - limit, count)
+
+    def load_summary(self):
+        """Cached rolling summary: {"summary": text, "covered": messages summarized}"""
+        try:
+            with open(self.summary_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"summary": "", "covered": 0}
+
+    def save_summary(self, summary, base=None):
+        """Cache summary, unless base is given and messages were dropped since
+
+        A summary computed from positions as of an older base would cover the
+        wrong messages; it is not saved and False is returned.
+        """
+        with self._lock:
+            if base is not None and base != self.base:
+                return False
+            self._atomic_write(self.summary_path, json.dumps(summary, ensure_ascii=False).encode("utf-8"))
+            return True
+
+    def _maybe_compact(self):
+        with self._lock:
+            if not self._needs_compaction or self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_in_background, name="chat-log-compaction", daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Error compacting chat history: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self):
+        """Rewrite the log and index keeping only live messages"""
+        with self._lock:
+            count = self.count()
+            if self.max_messages:
+                messages = self.tail(self.max_messages)
+            else:
+                messages = self.read(0, count)
+            self._rewrite(messages)
+
+            # Positions shift down by however many old messages were dropped
+            dropped = count - len(messages)
+            self.base += dropped
+            if dropped and os.path.exists(self.summary_path):
+                summary = self.load_summary()
+                summary["covered"] = max(summary.get("covered", 0) - dropped, 0)
+                self.save_summary(summary)
+            self._appends_since_compaction = 0
+            self._needs_compaction = False
+
+    def _rewrite(self, messages):
+        """Replace the log and index with messages"""
+        lines = [(json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8") for message in messages]
+        offsets = []
+        position = 0
+        for line in lines:
+            offsets.append(position)
+            position += len(line)
+
+        # Log first: a crash before the index swap is repaired by _sync_index
+        self._atomic_write(self.path, b"".join(lines))
+        self._atomic_write(self.index_path, b"".join(offset.to_bytes(OFFSET_SIZE, "big") for offset in offsets))
+
+    def _atomic_write(self, path, data):
+        """Write data to a temporary file and rename it over path"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -0,0 +1,144 @@
+# Near-duplicate merging of report findings with MinHash and locality-sensitive hashing
+import os
+import random
+import re
+import unicodedata
+import zlib
+
+DEFAULT_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.7"))
+
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+PRIME = (1 << 61) - 1
+
+# Fixed seed so signatures are comparable across processes
+_random = random.Random(1234)
+HASH_PARAMS = [(_random.randrange(1, PRIME), _random.randrange(0, PRIME)) for _ in range(NUM_HASHES)]
+
+FILLER = set("""
+a an the and or of to in on at for with by from as is are was were be been being it its this that
+your you my our their his her there which who what level levels value values result results shows show showed
+appears seems within very
+""".split())
+
+NEGATIONS = {"no", "not", "never", "without", "none", "negative"}
+# Items that disagree on these say different things however alike they read
+DIRECTIONS = {
+    "high", "higher", "low", "lower", "elevated", "raised", "reduced", "increased", "decreased",
+    "normal", "abnormal", "above", "below", "borderline", "deficient", "positive"
+}
+
+# Vowel signs and viramas of Devanagari and Gujarati are combining marks, not
+# word characters, so a word is a letter followed by letters and marks
+# (the marks of the scripts up to U+1FFF, which cover the Indic ones)
+MARKS = "".join(chr(code) for code in range(0x300, 0x2000) if unicodedata.category(chr(code)).startswith("M"))
+TOKEN = re.compile(r"\d+(?:\.\d+)?|[^\W\d_](?:[^\W\d_]|[" + re.escape(MARKS) + "])*")
+
+# Items with fewer words than this, numbers aside, are never merged: two
+# short findings that share a number say nothing else in common
+MIN_WORDS = 2
+
+def tokens(text):
+    """Content words and numbers of an item, as a set"""
+    return {token for token in TOKEN.findall(text.casefold()) if token not in FILLER}
+
+def mergeable(token_set):
+    """Whether an item has enough words to be merged with another"""
+    return sum(1 for token in token_set if not token[0].isdigit()) >= MIN_WORDS
+
+def guard_key(token_set):
+    """Numbers, negation and direction words; items must agree on these to merge"""
+    return (
+        frozenset(token for token in token_set if token[0].isdigit()),
+        bool(token_set & NEGATIONS),
+        frozenset(token_set & DIRECTIONS)
+    )
+
+# Below this many items with the same guard key, comparing every pair is cheaper
+PAIRWISE_MAX = 48
+
+def token_hashes(token, cache):
+    hashes = cache.get(token)
+    if hashes is None:
+        h = zlib.crc32(token.encode("utf-8"))
+        hashes = cache[token] = tuple((a * h + b) % PRIME for a, b in HASH_PARAMS)
+    return hashes
+
+def minhash(token_set, cache):
+    """MinHash signature; findings share most words, so per-word hashes are cached"""
+    return list(map(min, zip(*(token_hashes(token, cache) for token in token_set))))
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second)
+
+def _find(parents, item):
+    while parents[item] != item:
+        parents[item] = parents[parents[item]]
+        item = parents[item]
+    return item
+
+def dedupe(items, threshold=DEFAULT_THRESHOLD):
+    """Merge near-duplicate strings, keeping the most informative of each group
+
+    Items are compared as sets of content words, and only items that agree
+    on numbers, negation and direction words ("high" vs "low") can merge.
+    Items with fewer than MIN_WORDS words besides numbers are kept as they
+    are.
+    Within a large group of those, MinHash signatures are split into bands
+    and only items sharing a band bucket become candidate pairs, so the work
+    grows roughly linearly with the number of items. Candidates merge when
+    their Jaccard similarity reaches threshold.
+    Of each group the item with the most distinct words is kept (the
+    longest on a tie), at the position the group first appears.
+    """
+    items = list(dict.fromkeys(items))
+    token_sets = [tokens(item) for item in items]
+    parents = list(range(len(items)))
+
+    # Only items with the same guard key can merge
+    groups = {}
+    for index, token_set in enumerate(token_sets):
+        if mergeable(token_set):
+            groups.setdefault(guard_key(token_set), []).append(index)
+
+    cache = {}
+    for group in groups.values():
+        if len(group) <= PAIRWISE_MAX:
+            candidate_lists = [group]
+        else:
+            buckets = {}
+            for index in group:
+                signature = minhash(token_sets[index], cache)
+                for band in range(BANDS):
+                    key = (band, tuple(signature[band * ROWS:(band + 1) * ROWS]))
+                    buckets.setdefault(key, []).append(index)
+            candidate_lists = [bucket for bucket in buckets.values() if len(bucket) > 1]
+
+        # Compare each candidate with one representative per group seen
+        for candidates in candidate_lists:
+            representatives = []
+            for index in candidates:
+                root = _find(parents, index)
+                for representative in representatives:
+                    representative_root = _find(parents, representative)
+                    if representative_root == root:
+                        break
+                    if jaccard(token_sets[representative], token_sets[index]) >= threshold:
+                        parents[root] = representative_root
+                        break
+                else:
+                    representatives.append(index)
+
+    best = {}
+    order = []
+    for index, item in enumerate(items):
+        root = _find(parents, index)
+        if root not in best:
+            order.append(root)
+            best[root] = index
+            continue
+        kept = best[root]
+        if (len(token_sets[index]), len(item)) > (len(token_sets[kept]), len(items[kept])):
+            best[root] = index
+    return [items[best[root]] for root in order]
@@ -0,0 +1,109 @@
+# Bounded concurrent dispatch of per-page model calls
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", "4"))
+
+def dispatch_pages(analyze_page, pages, max_in_flight=None):
+    """Run analyze_page over every page concurrently, keeping page order
+
+    pages may be any iterable, including a generator that renders pages on
+    demand. It is only advanced while fewer than max_in_flight pages are
+    being analyzed, so producing the next page overlaps with the model calls
+    and at most max_in_flight pages are held at once.
+
+    Returns (results, failed_pages). results has one entry per page in the
+    original order, None for pages that failed. failed_pages lists
+    {"page": <1-based number>, "error": <message>} for each failure.
+    """
+    if max_in_flight is None:
+        max_in_flight = DEFAULT_MAX_IN_FLIGHT
+    max_in_flight = max(1, int(max_in_flight))
+
+    results = {}
+    failures = {}
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            index = pending.pop(future)
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                failures[index] = str(e)
+
+    count = 0
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for index, page in enumerate(pages):
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            # Run in a copy of our context so per-request timing spans reach the caller
+            pending[executor.submit(contextvars.copy_context().run, analyze_page, page)] = index
+            count = index + 1
+            # Drop our reference so a finished page can be freed right away
+            del page
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    ordered = [results.get(index) for index in range(count)]
+    failed_pages = [
+        {"page": index + 1, "error": failures[index]}
+        for index in sorted(failures)
+    ]
+    return ordered, failed_pages
+
+async def adispatch_pages(analyze_page, pages, max_in_flight=None):
+    """Async dispatch_pages: analyze_page is a coroutine function
+
+    pages is an ordinary iterable such as a rendering generator. Advancing
+    it is CPU-bound, so each step runs in a worker thread and the event
+    loop stays free while the next page is produced.
+    """
+    if max_in_flight is None:
+        max_in_flight = DEFAULT_MAX_IN_FLIGHT
+    max_in_flight = max(1, int(max_in_flight))
+
+    results = {}
+    failures = {}
+    pending = {}
+
+    def collect(done):
+        for task in done:
+            index = pending.pop(task)
+            try:
+                results[index] = task.result()
+            except Exception as e:
+                failures[index] = str(e)
+
+    iterator = iter(pages)
+    finished = object()
+    count = 0
+    try:
+        while True:
+            if len(pending) >= max_in_flight:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+            page = await asyncio.to_thread(next, iterator, finished)
+            if page is finished:
+                break
+            pending[asyncio.ensure_future(analyze_page(page))] = count
+            count += 1
+            del page
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            collect(done)
+    finally:
+        # Producing a page failed or we were cancelled: do not leak tasks
+        for task in pending:
+            task.cancel()
+
+    ordered = [results.get(index) for index in range(count)]
+    failed_pages = [
+        {"page": index + 1, "error": failures[index]}
+        for index in sorted(failures)
+    ]
+    return ordered, failed_pages
@@ -0,0 +1,56 @@
+# Named image encoding profiles for report pages sent to Gemini
+import io
+import os
+from PIL import Image
+
+# Gemini scales anything larger than this down before the model sees it
+GEMINI_MAX_EDGE = 3072
+
+MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp"
+}
+
+# dpi is the rasterization resolution; max_edge caps the longest side after
+# rendering. The png-* profiles reproduce the original lossless output.
+ENCODING_PROFILES = {
+    "png-300": {"format": "PNG", "dpi": 300, "quality": None, "grayscale": False, "max_edge": None},
+    "png-200": {"format": "PNG", "dpi": 200, "quality": None, "grayscale": False, "max_edge": None},
+    "png-gray-200": {"format": "PNG", "dpi": 200, "quality": None, "grayscale": True, "max_edge": GEMINI_MAX_EDGE},
+    "jpeg-q85": {"format": "JPEG", "dpi": 200, "quality": 85, "grayscale": False, "max_edge": 2048},
+    "jpeg-gray-q80": {"format": "JPEG", "dpi": 200, "quality": 80, "grayscale": True, "max_edge": 2048},
+    "webp-q80": {"format": "WEBP", "dpi": 200, "quality": 80, "grayscale": False, "max_edge": 2048},
+    "webp-gray-q75": {"format": "WEBP", "dpi": 150, "quality": 75, "grayscale": True, "max_edge": 1536}
+}
+
+def get_encoding_profile(name=None, default="png-300"):
+    """Look up a profile by name, falling back to REPORT_ENCODING_PROFILE and then default"""
+    name = name or os.getenv("REPORT_ENCODING_PROFILE") or default
+    if name not in ENCODING_PROFILES:
+        raise ValueError(f"Unknown encoding profile: {name}")
+    return dict(ENCODING_PROFILES[name], name=name)
+
+def encode_image(image, profile):
+    """Encode a PIL image into a Gemini inline part according to profile"""
+    if profile["grayscale"]:
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    max_edge = profile["max_edge"]
+    if max_edge and max(image.size) > max_edge:
+        scale = max_edge / max(image.size)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS)
+
+    options = {}
+    if profile["quality"] is not None:
+        options["quality"] = profile["quality"]
+
+    img_byte_arr = io.BytesIO()
+    image.save(img_byte_arr, format=profile["format"], **options)
+    return {
+        "mime_type": MIME_TYPES[profile["format"]],
+        "data": img_byte_arr.getvalue()
+    }
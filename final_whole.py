@@ -1,21 +1,53 @@
 import streamlit as st
-import google.generativeai as genai
 import pdf2image
 from PIL import Image
 import io
 import sys
 import os
 import json
+import subprocess
+import tempfile
+import weakref
+from collections import OrderedDict
 from pathlib import Path
 from dotenv import load_dotenv
+from dispatch import dispatch_pages
+from report_cache import ReportCache, DEFAULT_CACHE_DIR, content_hash, report_key, page_key
+from render_cache import RenderCache
+from page_filter import filter_pages
+from encoding import encode_image, get_encoding_profile
+from batching import batch_pages, batch_prompt, split_batch_response
+from gemini_client import get_model
+from report_schema import generation_config, parse_page, parse_batch, validate_page
+from reduce import reduce_tree, merge_analyses
 
 load_dotenv()
 
+# Bump whenever the analysis prompt changes so cached analyses are not reused
+PROMPT_VERSION = "streamlit-report-v3"
+
+report_cache = ReportCache(os.path.join(DEFAULT_CACHE_DIR, "reports"))
+page_cache = ReportCache(os.path.join(DEFAULT_CACHE_DIR, "pages"))
+reduce_cache = ReportCache(os.path.join(DEFAULT_CACHE_DIR, "reduce"))
+
+# Image format/DPI/size used for pages, see encoding.ENCODING_PROFILES
+ENCODING_PROFILE = get_encoding_profile(default="png-200")
+
+# Analyses kept in each browser session, so reruns redisplay them without the model
+SESSION_ANALYSES = int(os.getenv("REPORT_SESSION_ANALYSES", "8"))
+
+@st.cache_resource
+def get_render_cache():
+    """Encoded pages of recent uploads, shared by every session on this server
+
+    Its size is bounded by RENDER_CACHE_MAX_MB; the least recently used
+    documents are evicted first, whichever session uploaded them.
+    """
+    return RenderCache()
+
 def configure_gemini():
-    """Configure Gemini API"""
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    return model
+    """Get the shared Gemini model, reused across reruns and sessions"""
+    return get_model('gemini-1.5-flash', os.getenv("GEMINI_API_KEY"))
 
 def get_poppler_path():
     """Get the poppler path"""
@@ -35,33 +67,123 @@ def get_poppler_path():
                 return path
     return None
 
-def pdf_to_images(pdf_file, poppler_path=None):
-    """Convert PDF to images"""
+def resolve_poppler_path(poppler_path=None):
+    """Locate poppler on Windows and put it on PATH"""
+    if sys.platform.startswith('win'):
+        if poppler_path is None:
+            poppler_path = get_poppler_path()
+        os.environ['PATH'] = poppler_path + os.pathsep + os.environ['PATH']
+    return poppler_path
+
+def iter_pdf_pages(pdf_bytes, dpi=200, poppler_path=None):
+    """Render PDF pages one at a time
+
+    The PDF is written to one temporary file and its page count read
+    eagerly, so a broken upload fails here; each page is only rasterized,
+    by one pdftoppm run on that file, as the returned generator is
+    consumed. The file is removed when the generator is exhausted, closed
+    or garbage collected, even if it was never started.
+    """
+    poppler_path = resolve_poppler_path(poppler_path)
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
     try:
-        pdf_bytes = pdf_file.read()
-        if sys.platform.startswith('win'):
-            if poppler_path is None:
-                poppler_path = get_poppler_path()
-            os.environ['PATH'] = poppler_path + os.pathsep + os.environ['PATH']
-        
-        images = pdf2image.convert_from_bytes(pdf_bytes, dpi=200, poppler_path=poppler_path)
-        return images
-    except Exception as e:
-        st.error(f"Error processing PDF: {str(e)}")
-        return None
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_bytes)
+        info = pdf2image.pdfinfo_from_path(pdf_path, poppler_path=poppler_path)
+    except Exception:
+        _remove_file(pdf_path)
+        raise
+    pages = _render_pages(pdf_path, info["Pages"], dpi, poppler_path)
+    weakref.finalize(pages, _remove_file, pdf_path)
+    return pages
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _render_pages(pdf_path, page_count, dpi, poppler_path):
+    pdftoppm = os.path.join(poppler_path, "pdftoppm") if poppler_path else "pdftoppm"
+    try:
+        for page_num in range(1, page_count + 1):
+            # Without an output root pdftoppm writes the page to stdout as PPM
+            result = subprocess.run(
+                [pdftoppm, "-r", str(dpi), "-f", str(page_num), "-l", str(page_num), pdf_path],
+                capture_output=True
+            )
+            if result.returncode != 0 or not result.stdout:
+                raise RuntimeError(f"pdftoppm failed on page {page_num}: {result.stderr.decode(errors='replace').strip()}")
+            image = Image.open(io.BytesIO(result.stdout))
+            image.load()
+            yield image
+    finally:
+        _remove_file(pdf_path)
+
+def encode_images(images, profile=None):
+    """Encode images as parts as they are consumed, PNG unless a profile is given
+
+    Pages that are already encoded (page_number, part) pairs, such as those
+    from rendered_pages(), pass through.
+    """
+    for image in images:
+        if isinstance(image, tuple):
+            yield image
+            continue
+
+        if profile is not None:
+            yield encode_image(image, profile)
+            continue
+
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format='PNG')
+        yield {
+            "mime_type": "image/png",
+            "data": img_byte_arr.getvalue()
+        }
+
+def rendered_pages(pdf_bytes, upload_hash):
+    """Encoded (page_number, part) pairs of an upload, rendered at most once while they stay cached
 
-def get_gemini_response(model, images, language):
-    """Get consolidated analysis from Gemini for all images"""
+    Blank and repeated pages are dropped before encoding, see
+    page_filter.filter_pages. On a miss the pages are rendered and encoded
+    lazily, so they still overlap with the model calls, and cached once the
+    last one is produced.
+    """
+    render_cache = get_render_cache()
+    key = (upload_hash, ENCODING_PROFILE["name"])
+    pages = render_cache.get(key)
+    if pages is not None:
+        return pages
+    page_numbers = []
+    images = filter_pages(iter_pdf_pages(pdf_bytes, dpi=ENCODING_PROFILE["dpi"]), page_numbers)
+    parts = encode_images(images, ENCODING_PROFILE)
+    return render_cache.collect(key, ((page_numbers[index], part) for index, part in enumerate(parts)))
+
+def session_analyses():
+    """This session's analyses by (upload hash, language), oldest first"""
+    if "analyses" not in st.session_state:
+        st.session_state.analyses = OrderedDict()
+    return st.session_state.analyses
+
+def remember_analysis(key, analysis):
+    analyses = session_analyses()
+    analyses[key] = analysis
+    analyses.move_to_end(key)
+    while len(analyses) > SESSION_ANALYSES:
+        analyses.popitem(last=False)
+
+def get_gemini_response(model, images, language, max_in_flight=None, profile=None, batch_size=None):
+    """Get consolidated analysis from Gemini for all images
+
+    images can be a list or a generator such as iter_pdf_pages(); pages are
+    encoded and sent as they arrive, with at most max_in_flight requests held
+    at once. Each request carries up to batch_size pages. images may also be
+    the (page_number, part) pairs of rendered_pages().
+    """
     try:
-        # Convert all images to byte arrays
-        image_parts = []
-        for image in images:
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='PNG')
-            image_parts.append({
-                "mime_type": "image/png",
-                "data": img_byte_arr.getvalue()
-            })
+        # Encode lazily so rendering, encoding and the model calls overlap
+        image_parts = encode_images(images, profile)
         
         prompt = f"""
         Summarize the following medical report in {language} in a clear, concise and easy-to-understand way:
@@ -126,33 +248,88 @@ def get_gemini_response(model, images, language):
         5. Highlight any urgent actions needed
         """
 
-        # Process each image and combine results
+        def analyze_batch(batch):
+            # Serve what we can from the page cache, send the rest in one request
+            analyses = {}
+            to_send = []
+            for page_number, image_part in batch:
+                cache_key = page_key(image_part["data"], language, PROMPT_VERSION)
+                cached = page_cache.get(cache_key)
+                if cached is not None:
+                    analyses[page_number] = cached
+                else:
+                    to_send.append((page_number, image_part, cache_key))
+
+            # Schema-constrained JSON; stray fences or prose are still recovered locally
+            if len(to_send) == 1:
+                response = model.generate_content([prompt, to_send[0][1]], generation_config=generation_config())
+                new_analyses = [parse_page(response.text)]
+            elif to_send:
+                content = [batch_prompt(prompt, len(to_send))]
+                for page_number, image_part, _ in to_send:
+                    content.extend([f"Page {page_number}:", image_part])
+                response = model.generate_content(content, generation_config=generation_config(batch=True))
+                new_analyses = [
+                    validate_page(page)
+                    for page in split_batch_response(
+                        parse_batch(response.text),
+                        [page_number for page_number, _, _ in to_send]
+                    )
+                ]
+            else:
+                new_analyses = []
+
+            for (page_number, _, cache_key), page_analysis in zip(to_send, new_analyses):
+                page_cache.set(cache_key, page_analysis)
+                analyses[page_number] = page_analysis
+            return [analyses[page_number] for page_number, _ in batch]
+
+        # Pack pages into requests of up to batch_size pages within the byte budget
+        batch_page_numbers = []
+
+        def batches():
+            numbered = (
+                part if isinstance(part, tuple) else (page_number, part)
+                for page_number, part in enumerate(image_parts, 1)
+            )
+            for batch in batch_pages(numbered, batch_size):
+                batch_page_numbers.append([page_number for page_number, _ in batch])
+                yield batch
+
+        # Process the batches concurrently, results come back in page order
+        batch_results, failed_batches = dispatch_pages(analyze_batch, batches(), max_in_flight)
+
+        # Flatten back to one analysis per page, keeping each page attributable
         responses = []
-        for image_part in image_parts:
-            try:
-                response = model.generate_content([prompt, image_part])
-                try:
-                    json_response = json.loads(response.text)
-                    responses.append(json_response)
-                except json.JSONDecodeError:
-                    cleaned_response = response.text.strip()
-                    if cleaned_response.startswith("```json"):
-                        cleaned_response = cleaned_response[7:-3]
-                    responses.append(json.loads(cleaned_response))
-            except Exception as e:
-                st.warning(f"Error processing an image: {str(e)}")
-                continue
+        for page_numbers, batch_result in zip(batch_page_numbers, batch_results):
+            responses.extend(batch_result or [None] * len(page_numbers))
+        failed_pages = [
+            {"page": page_number, "error": failure["error"]}
+            for failure in failed_batches
+            for page_number in batch_page_numbers[failure["page"] - 1]
+        ]
+
+        # Streamlit calls are only safe on the script thread, so failures are
+        # reported here rather than from the workers.
+        for failure in failed_pages:
+            st.warning(f"Error processing page {failure['page']}: {failure['error']}")
 
         # Combine all responses into a single analysis
-        combined_analysis = combine_analyses(responses)
+        combined_analysis = combine_analyses(responses, model, language)
+        combined_analysis["failed_pages"] = failed_pages
         return combined_analysis
 
     except Exception as e:
         st.error(f"Error in Gemini analysis: {str(e)}")
         return None
 
-def combine_analyses(responses):
-    """Combine multiple analyses into one comprehensive report"""
+def combine_analyses(responses, model=None, language="English"):
+    """Combine multiple analyses into one comprehensive report
+
+    Page analyses are merged in a tree, see reduce.reduce_tree: list fields
+    are joined with near-duplicates merged, and the model writes the overall
+    status and summary of every merged group from those of its parts.
+    """
     combined = {
         "test_results": {
             "key_findings": [],
@@ -172,50 +349,19 @@ def combine_analyses(responses):
         "summary": ""
     }
 
-    for response in responses:
-        if not response:
-            continue
-
-        # Combine test results
-        for category in ["key_findings", "abnormal_values", "normal_values"]:
-            combined["test_results"][category].extend(
-                response.get("test_results", {}).get(category, [])
-            )
+    pages = [response for response in responses if response]
+    if not pages:
+        return combined
 
-        # Update health assessment
-        assessment = response.get("health_assessment", {})
-        if assessment.get("overall_status"):
-            combined["health_assessment"]["overall_status"] = assessment["overall_status"]
-        combined["health_assessment"]["areas_of_concern"].extend(
-            assessment.get("areas_of_concern", [])
-        )
-        combined["health_assessment"]["positive_indicators"].extend(
-            assessment.get("positive_indicators", [])
-        )
-
-        # Combine recommendations
-        for category in ["immediate_actions", "follow_up_tests", "lifestyle_changes"]:
-            combined["recommendations"][category].extend(
-                response.get("recommendations", {}).get(category, [])
-            )
-
-    # Remove duplicates while preserving order
-    for category in combined["test_results"]:
-        combined["test_results"][category] = list(dict.fromkeys(
-            combined["test_results"][category]
-        ))
-    for category in combined["health_assessment"]:
-        if isinstance(combined["health_assessment"][category], list):
-            combined["health_assessment"][category] = list(dict.fromkeys(
-                combined["health_assessment"][category]
-            ))
-    for category in combined["recommendations"]:
-        combined["recommendations"][category] = list(dict.fromkeys(
-            combined["recommendations"][category]
-        ))
-
-    # Create a comprehensive summary
-    combined["summary"] = "Complete analysis of all report pages combined."
+    reduced = reduce_tree(
+        pages,
+        lambda children: merge_analyses(children, model, language),
+        cache=reduce_cache,
+        key_parts=(language, PROMPT_VERSION)
+    )
+    for section in ["test_results", "health_assessment", "recommendations"]:
+        combined[section].update(reduced.get(section, {}))
+    combined["summary"] = reduced.get("summary", "")
     return combined
 
 def display_analysis(analysis):
@@ -270,32 +416,54 @@ def main():
 
     if uploaded_file:
         try:
-            # Convert PDF to images
-            with st.spinner("Processing PDF..."):
-                images = pdf_to_images(uploaded_file)
-                if not images:
+            # Every widget interaction reruns this script: look for an analysis
+            # of this upload and language in the session, then in the cache
+            pdf_bytes = uploaded_file.getvalue()
+            upload_hash = content_hash(b"upload", pdf_bytes)
+            session_key = (upload_hash, language)
+            analysis = session_analyses().get(session_key)
+            if analysis is None:
+                cache_key = report_key(pdf_bytes, language, PROMPT_VERSION)
+                analysis = report_cache.get(cache_key)
+                if analysis is not None:
+                    remember_analysis(session_key, analysis)
+
+            # Only the button calls the model; a partial analysis can be retried
+            # and pages that were analyzed come back from the page cache
+            label = "Analyze Report" if analysis is None else "Retry Failed Pages"
+            if (analysis is None or analysis["failed_pages"]) and st.button(label):
+                # Pages are rendered once per upload, later analyses reuse them
+                try:
+                    pages = rendered_pages(pdf_bytes, upload_hash)
+                except Exception as e:
+                    st.error(f"Error processing PDF: {str(e)}")
                     st.error("Could not process the PDF. Please check the file.")
                     return
 
-            # Analyze button
-            if st.button("Analyze Report"):
                 with st.spinner("Analyzing report..."):
                     # Get consolidated analysis
-                    analysis = get_gemini_response(model, images, language)
-                    if analysis:
-                        # Display analysis
-                        display_analysis(analysis)
-                        
-                        # Add download button
-                        json_str = json.dumps(analysis, indent=2)
-                        st.download_button(
-                            label="📥 Download Analysis",
-                            data=json_str,
-                            file_name="medical_analysis.json",
-                            mime="application/json"
-                        )
-                    else:
-                        st.error("Could not generate analysis. Please try again.")
+                    new_analysis = get_gemini_response(model, pages, language, profile=ENCODING_PROFILE)
+                if new_analysis:
+                    analysis = new_analysis
+                    remember_analysis(session_key, analysis)
+                    # Partial analyses are not cached so a retry can fill the gaps
+                    if not analysis["failed_pages"]:
+                        report_cache.set(report_key(pdf_bytes, language, PROMPT_VERSION), analysis)
+                elif analysis is None:
+                    st.error("Could not generate analysis. Please try again.")
+
+            if analysis:
+                # Display analysis
+                display_analysis(analysis)
+                
+                # Add download button
+                json_str = json.dumps(analysis, indent=2)
+                st.download_button(
+                    label="📥 Download Analysis",
+                    data=json_str,
+                    file_name="medical_analysis.json",
+                    mime="application/json"
+                )
 
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
@@ -0,0 +1,127 @@
+# Process-wide registry of configured Gemini models
+import asyncio
+import logging
+import os
+import threading
+import weakref
+
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+
+try:
+    from .rate_limit import LimitedModel, default_limiter
+except ImportError:
+    from rate_limit import LimitedModel, default_limiter
+
+logger = logging.getLogger(__name__)
+
+_models = {}
+_clients = {}
+_lock = threading.Lock()
+
+class KeyClients:
+    """Gemini service clients for one API key
+
+    genai.configure is process-global, and a GenerativeModel binds whichever
+    key was configured last the first time it is called, sync and async
+    separately. With the chat and report models on different keys, one of
+    them would end up calling with the other's key. Models from get_model
+    use these clients instead, so genai is never configured.
+    """
+
+    def __init__(self, api_key=None):
+        # Same fallbacks as genai.configure
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = glm.GenerativeServiceClient(client_options={"api_key": self.api_key})
+            return self._client
+
+    def async_client(self):
+        """The async client for the running event loop
+
+        The async transport's channel belongs to the loop it was created in,
+        and async_to_sync or asyncio.run give each call a new loop, so there
+        is one client per loop. The channel keeps its loop alive, so clients
+        of loops that have closed are dropped here rather than left to the
+        weak references.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                for closed in [other for other in self._async_clients if other.is_closed()]:
+                    del self._async_clients[closed]
+                client = glm.GenerativeServiceAsyncClient(client_options={"api_key": self.api_key})
+                self._async_clients[loop] = client
+            return client
+
+class KeyedModel(genai.GenerativeModel):
+    """GenerativeModel that always calls through its own KeyClients"""
+
+    def __init__(self, model_name, clients):
+        self._clients = clients
+        super().__init__(model_name)
+
+    # GenerativeModel assigns _client and _async_client itself, on creation
+    # and on first use; those assignments are ignored
+    @property
+    def _client(self):
+        return self._clients.client()
+
+    @_client.setter
+    def _client(self, value):
+        pass
+
+    @property
+    def _async_client(self):
+        return self._clients.async_client()
+
+    @_async_client.setter
+    def _async_client(self, value):
+        pass
+
+def get_model(model_name, api_key=None):
+    """Return the shared GenerativeModel for (model_name, api_key)
+
+    The model is created on first use and reused by every later request, so
+    it keeps its client connection warm. Models with the same API key share
+    their clients, see KeyClients. Generate calls go through the shared
+    rate limiter, so every caller backs off together when quota runs out.
+    """
+    key = (model_name, api_key)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            clients = _clients.get(api_key)
+            if clients is None:
+                clients = _clients[api_key] = KeyClients(api_key)
+            model = LimitedModel(KeyedModel(model_name, clients), default_limiter)
+            _models[key] = model
+    return model
+
+def warm_up(model_name, api_key=None):
+    """Create the model and open its connection with a cheap token count"""
+    try:
+        get_model(model_name, api_key).count_tokens("ping")
+    except Exception as e:
+        logger.warning("Gemini warm-up for %s failed: %s", model_name, e)
+
+def warm_up_in_background(model_names, api_key=None):
+    """Warm up models without delaying worker start"""
+    def run():
+        for model_name in model_names:
+            warm_up(model_name, api_key)
+
+    thread = threading.Thread(target=run, name="gemini-warm-up", daemon=True)
+    thread.start()
+    return thread
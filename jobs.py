@@ -0,0 +1,276 @@
+# Background job queue for report analysis, persisted in SQLite
+import contextlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.getenv("REPORT_JOBS_DB", "report_jobs.sqlite3")
+DEFAULT_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+# Finished jobs are kept this long for polling, in seconds
+DEFAULT_RETENTION = int(os.getenv("REPORT_JOB_RETENTION", str(24 * 3600)))
+# A running job whose owner has not renewed its lease for this long, in
+# seconds, is taken to have died with its process and is queued again
+DEFAULT_LEASE = int(os.getenv("REPORT_JOB_LEASE", "60"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    upload BLOB,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    pages_total INTEGER,
+    pages TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    owner TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+"""
+
+# Columns added after the first release, for databases created before them
+MIGRATIONS = {
+    "owner": "ALTER TABLE jobs ADD COLUMN owner TEXT",
+    "lease_until": "ALTER TABLE jobs ADD COLUMN lease_until REAL",
+}
+
+class JobProgress:
+    """Handed to the job handler to report per-page progress"""
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    def total(self, pages_total):
+        self.queue._execute(
+            "UPDATE jobs SET pages_total = ? WHERE id = ?",
+            (pages_total, self.job_id)
+        )
+
+    def pages(self, page_numbers, status):
+        """Record status ("done", "failed" or "skipped") for each of page_numbers"""
+        with self.queue._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # A job whose lease another process took over is no longer ours to report on
+            row = conn.execute(
+                "SELECT pages FROM jobs WHERE id = ? AND owner = ?",
+                (self.job_id, self.queue.owner)
+            ).fetchone()
+            if row is None:
+                return
+            pages = json.loads(row[0])
+            for page_number in page_numbers:
+                pages[str(page_number)] = status
+            conn.execute("UPDATE jobs SET pages = ? WHERE id = ?", (json.dumps(pages), self.job_id))
+
+class JobQueue:
+    """Durable local job queue worked by a pool of threads
+
+    Jobs live in a SQLite database, so no broker is needed and queued work
+    survives a restart. Several processes may share one database: claiming
+    a job happens inside an immediate transaction and records this queue
+    as its owner with a lease, which a heartbeat thread renews while the
+    job runs. Only jobs whose lease has expired, because their process
+    died, are taken back and run again. handler(job, progress)
+    receives the job as a dict (id, payload, upload) and returns a
+    JSON-serializable result.
+    """
+
+    def __init__(self, handler, db_path=DEFAULT_DB_PATH, workers=DEFAULT_WORKERS,
+                 poll_interval=0.5, retention=DEFAULT_RETENTION, lease=DEFAULT_LEASE):
+        self.handler = handler
+        self.db_path = db_path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.lease = lease
+        # Unique per queue, so two queues in one process do not share leases
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, sql in MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(sql)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _execute(self, sql, params=()):
+        with self._connect() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def start(self):
+        """Start the worker threads once per process"""
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"report-job-worker-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name="report-job-heartbeat", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, payload, upload=None):
+        """Queue a job and return its id"""
+        job_id = uuid.uuid4().hex
+        self._execute(
+            "INSERT INTO jobs (id, status, payload, upload, created) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, json.dumps(payload), upload, time.time())
+        )
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Job status with per-page progress, or None if unknown"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, status, created, started, finished, pages_total, pages, error"
+                " FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            position = None
+            if row["status"] == "queued":
+                position = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?",
+                    (row["created"],)
+                ).fetchone()[0]
+
+        pages = json.loads(row["pages"])
+        return {
+            "id": row["id"],
+            "status": row["status"],
+            "queue_position": position,
+            "created": row["created"],
+            "started": row["started"],
+            "finished": row["finished"],
+            "pages_total": row["pages_total"],
+            "pages_done": sum(1 for status in pages.values() if status == "done"),
+            "pages_failed": sum(1 for status in pages.values() if status == "failed"),
+            "pages_skipped": sum(1 for status in pages.values() if status == "skipped"),
+            "pages": {int(page): status for page, status in pages.items()},
+            "error": row["error"]
+        }
+
+    def result(self, job_id):
+        """Result of a finished job, or None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["result"] is None:
+            return None
+        return json.loads(row["result"])
+
+    def stats(self):
+        """Queue depth and job counts by status"""
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = conn.execute("SELECT MIN(created) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        return {
+            "queue_depth": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_queued_age": time.time() - oldest if oldest else 0.0,
+            "workers": self.workers if self._threads else 0
+        }
+
+    def _claim(self):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Jobs of a process that died go back to the queue once their lease runs out
+            expired = conn.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL, pages = '{}', owner = NULL, lease_until = NULL"
+                " WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+                (now,)
+            ).rowcount
+            if expired:
+                logger.warning("Requeued %d report jobs whose worker stopped renewing its lease", expired)
+            row = conn.execute(
+                "SELECT id, payload, upload FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started = ?, owner = ?, lease_until = ? WHERE id = ?",
+                (now, self.owner, now + self.lease, row["id"])
+            )
+        return {"id": row["id"], "payload": json.loads(row["payload"]), "upload": row["upload"]}
+
+    def _work(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.warning("Could not claim report job: %s", e)
+                job = None
+
+            if job is None:
+                self._prune()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                result = self.handler(job, JobProgress(self, job["id"]))
+                self._finish(job["id"], "UPDATE jobs SET status = 'done', finished = ?, result = ?,"
+                             " upload = NULL WHERE id = ? AND owner = ?", (time.time(), json.dumps(result)))
+            except Exception as e:
+                logger.exception("Report job %s failed", job["id"])
+                self._finish(job["id"], "UPDATE jobs SET status = 'failed', finished = ?, error = ?,"
+                             " upload = NULL WHERE id = ? AND owner = ?", (time.time(), str(e)))
+
+    def _finish(self, job_id, sql, params):
+        # Our lease ran out and another process took the job over: its run wins
+        if not self._execute(sql, params + (job_id, self.owner)):
+            logger.warning("Report job %s was taken over by another worker, dropping this run's outcome", job_id)
+
+    def _heartbeat(self):
+        """Renew the leases of the jobs this queue is running"""
+        while True:
+            time.sleep(max(0.1, self.lease / 3))
+            try:
+                self._execute(
+                    "UPDATE jobs SET lease_until = ? WHERE status = 'running' AND owner = ?",
+                    (time.time() + self.lease, self.owner)
+                )
+            except sqlite3.Error as e:
+                logger.warning("Could not renew report job leases: %s", e)
+
+    def _prune(self):
+        if not self.retention:
+            return
+        try:
+            self._execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+                (time.time() - self.retention,)
+            )
+        except sqlite3.Error as e:
+            logger.warning("Could not prune report jobs: %s", e)
@@ -1,35 +1,116 @@
-import google.generativeai as genai
 import streamlit as st
 from datetime import datetime
-import json
 import os
 from dotenv import load_dotenv
+from gemini_client import get_model
+from streaming import stream_text
+from chat_log import ChatLog
+from topic_filter import REFUSAL, is_off_topic
+from chat_context import (
+    DEFAULT_CONTEXT_TOKENS, estimate_tokens, select_recent, format_context, update_summary
+)
 
 load_dotenv()
 
-# Configure Gemini API
+# Configure Gemini API, the model is shared across reruns and sessions
 def setup_gemini(api_key):
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-pro')
-    return model
+    return get_model('gemini-pro', api_key)
 
-def load_chat_history():
+# Messages shown in a new session, and how many more each "load earlier" adds.
+# Older messages stay on disk and are paged in through the log's offset index.
+CHAT_HISTORY_TAIL = int(os.getenv("CHAT_HISTORY_TAIL", "20"))
+CHAT_HISTORY_PAGE = int(os.getenv("CHAT_HISTORY_PAGE", "20"))
+
+@st.cache_resource
+def get_chat_log():
+    """One record per line in chat_history.jsonl, migrated from chat_history.json
+
+    Streamlit reruns this script on every interaction; the log is built
+    once per server so its compaction counters and lock outlive reruns.
+    """
+    return ChatLog(
+        'chat_history.jsonl',
+        legacy_path='chat_history.json',
+        max_messages=int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "10000"))
+    )
+
+chat_log = get_chat_log()
+
+# Prompt budget for conversation context; older turns are folded into a
+# rolling summary every CHAT_SUMMARY_EVERY messages that fall out of it
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", str(DEFAULT_CONTEXT_TOKENS)))
+CHAT_SUMMARY_EVERY = int(os.getenv("CHAT_SUMMARY_EVERY", "4"))
+
+# Write the answer as it is generated instead of waiting for the whole response
+CHAT_STREAMING = os.getenv("CHAT_STREAMING", "1") != "0"
+
+def load_chat_history(limit=CHAT_HISTORY_TAIL):
+    try:
+        return chat_log.tail(limit)
+    except OSError as e:
+        print(f"Error loading chat history: {e}")
+    return []
+
+def load_earlier_messages(start, limit=CHAT_HISTORY_PAGE):
+    """Messages stored just before absolute position start"""
     try:
-        if os.path.exists('chat_history.json') and os.path.getsize('chat_history.json') > 0:
-            with open('chat_history.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError) as e:
+        return chat_log.read(start - limit, start)
+    except OSError as e:
         print(f"Error loading chat history: {e}")
     return []
 
-def save_chat_history(history):
+def save_chat_message(message):
     try:
-        with open('chat_history.json', 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
+        chat_log.append(message)
     except Exception as e:
         print(f"Error saving chat history: {e}")
 
-def get_bot_response(model, user_input, chat_history):
+def clear_chat_history():
+    try:
+        chat_log.clear()
+    except Exception as e:
+        print(f"Error clearing chat history: {e}")
+
+def rebase_history(state):
+    """Move the session's log position past messages the log dropped since it was taken
+
+    Compaction and clearing drop messages from the front of the log, which
+    shifts every later message down; chat_log.base counts them. Returns the
+    base the session's positions are now relative to.
+    """
+    base = chat_log.base
+    dropped = base - state.history_base
+    if dropped:
+        state.history_start = max(state.history_start - dropped, 0)
+        state.history_base = base
+    return base
+
+def update_rolling_summary(model, chat_history, history_start, base=None):
+    """Fold messages that no longer fit the context budget into the cached summary
+
+    history_start and the summary's covered count are positions as of base,
+    see rebase_history; if the log drops messages meanwhile the new summary
+    is not saved and is recomputed on a later turn.
+    """
+    summary = chat_log.load_summary()
+    budget = CHAT_CONTEXT_TOKENS - estimate_tokens(summary["summary"])
+    recent = select_recent(chat_history, budget)
+    boundary = history_start + len(chat_history) - len(recent)
+
+    if boundary - summary["covered"] >= CHAT_SUMMARY_EVERY:
+        try:
+            # Only the most recent unsummarized turns are worth a summary update
+            evicted = select_recent(chat_log.read(summary["covered"], boundary), 4 * CHAT_CONTEXT_TOKENS)
+            summary = {
+                "summary": update_summary(model, summary["summary"], evicted),
+                "covered": boundary
+            }
+            chat_log.save_summary(summary, base)
+        except Exception as e:
+            print(f"Error updating chat summary: {e}")
+    return summary["summary"]
+
+def build_prompt(user_input, chat_history, summary=""):
     # Context for the medical chatbot
     prompt = """
     You are a medical first aid assistant. Your role is to:
@@ -47,11 +128,31 @@ def get_bot_response(model, user_input, chat_history):
     User's current concern: {user_input}
     """
     
-    # Format chat context
-    chat_context = "\n".join([f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}" 
-                             for msg in chat_history[-5:]])  # Include last 5 messages for context
+    # Fill the context budget with the most recent messages, older turns are
+    # represented by the rolling summary
+    budget = max(CHAT_CONTEXT_TOKENS - estimate_tokens(summary), 1)
+    chat_context = format_context(select_recent(chat_history, budget), summary)
     
-    formatted_prompt = prompt.format(chat_context=chat_context, user_input=user_input)
+    return prompt.format(chat_context=chat_context, user_input=user_input)
+
+def refuse_off_topic(user_input, chat_history, summary=""):
+    """Whether to answer with REFUSAL instead of calling the model
+
+    Only the opening message of a conversation is filtered: a follow-up
+    such as "what if it happened in the car?" depends on earlier messages
+    the filter cannot see. chat_history may already end with user_input.
+    """
+    earlier = chat_history
+    if earlier and earlier[-1].get("content") == user_input:
+        earlier = earlier[:-1]
+    if earlier or summary:
+        return False
+    return is_off_topic(user_input)
+
+def get_bot_response(model, user_input, chat_history, summary=""):
+    if refuse_off_topic(user_input, chat_history, summary):
+        return REFUSAL
+    formatted_prompt = build_prompt(user_input, chat_history, summary)
     
     try:
         response = model.generate_content(formatted_prompt)
@@ -59,6 +160,18 @@ def get_bot_response(model, user_input, chat_history):
     except Exception as e:
         return f"I apologize, but I encountered an error: {str(e)}. Please try again."
 
+def stream_bot_response(model, user_input, chat_history, summary="", timings=None):
+    """Yield the bot response in chunks as the model generates it"""
+    if refuse_off_topic(user_input, chat_history, summary):
+        yield REFUSAL
+        return
+    formatted_prompt = build_prompt(user_input, chat_history, summary)
+    
+    try:
+        yield from stream_text(model, formatted_prompt, timings)
+    except Exception as e:
+        yield f"I apologize, but I encountered an error: {str(e)}. Please try again."
+
 def main():
     st.title("Medical First Aid Assistant")
     st.markdown("""
@@ -68,9 +181,15 @@ def main():
     - In case of emergency, call your local emergency number immediately
     """)
     
-    # Initialize session state for chat history if it doesn't exist
+    # Initialize session state for chat history if it doesn't exist.
+    # Only a window of recent messages is kept; history_start is the log
+    # position of the first one.
     if 'chat_history' not in st.session_state:
+        st.session_state.history_base = chat_log.base
         st.session_state.chat_history = load_chat_history()
+        st.session_state.history_start = chat_log.count() - len(st.session_state.chat_history)
+        st.session_state.history_window = CHAT_HISTORY_TAIL
+    rebase_history(st.session_state)
     
     # API Key input (you might want to handle this more securely in production)
     api_key = os.getenv("GOOGLE_API_KEY")
@@ -82,7 +201,16 @@ def main():
     try:
         model = setup_gemini(api_key)
         
-        # Chat interface
+        # Page older messages in from storage on request
+        if st.session_state.history_start > 0:
+            if st.button("Load earlier messages"):
+                rebase_history(st.session_state)
+                earlier = load_earlier_messages(st.session_state.history_start)
+                st.session_state.chat_history = earlier + st.session_state.chat_history
+                st.session_state.history_start -= len(earlier)
+                st.session_state.history_window += CHAT_HISTORY_PAGE
+        
+        # Chat interface, only the current window is rendered
         for message in st.session_state.chat_history:
             with st.chat_message(message["role"]):
                 st.write(message["content"])
@@ -99,33 +227,56 @@ def main():
                 st.caption(current_time)
             
             # Add user message to chat history
-            st.session_state.chat_history.append({
+            user_message = {
                 "role": "user",
                 "content": user_input,
                 "timestamp": current_time
-            })
+            }
+            st.session_state.chat_history.append(user_message)
+            save_chat_message(user_message)
             
             # Get and display bot response
             with st.chat_message("assistant"):
-                bot_response = get_bot_response(model, user_input, st.session_state.chat_history)
-                st.write(bot_response)
+                base = rebase_history(st.session_state)
+                summary = update_rolling_summary(
+                    model,
+                    st.session_state.chat_history,
+                    st.session_state.history_start,
+                    base
+                )
+                if CHAT_STREAMING:
+                    # Time to first token and total time go to streaming.stream_stats
+                    bot_response = st.write_stream(stream_bot_response(
+                        model, user_input, st.session_state.chat_history, summary
+                    ))
+                else:
+                    bot_response = get_bot_response(model, user_input, st.session_state.chat_history, summary)
+                    st.write(bot_response)
                 current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 st.caption(current_time)
             
             # Add bot response to chat history
-            st.session_state.chat_history.append({
+            bot_message = {
                 "role": "assistant",
                 "content": bot_response,
                 "timestamp": current_time
-            })
+            }
+            st.session_state.chat_history.append(bot_message)
+            save_chat_message(bot_message)
             
-            # Save chat history
-            save_chat_history(st.session_state.chat_history)
+            # Keep the window bounded so reruns stay constant-time
+            overflow = len(st.session_state.chat_history) - st.session_state.history_window
+            if overflow > 0:
+                del st.session_state.chat_history[:overflow]
+                st.session_state.history_start += overflow
             
         # Clear chat history button
         if st.sidebar.button("Clear Chat History"):
             st.session_state.chat_history = []
-            save_chat_history([])
+            st.session_state.history_start = 0
+            st.session_state.history_window = CHAT_HISTORY_TAIL
+            clear_chat_history()
+            st.session_state.history_base = chat_log.base
             st.rerun()
     
     except Exception as e:
@@ -0,0 +1,254 @@
+# In-process metrics with Prometheus text exposition and per-request timing spans
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+class _State:
+    enabled = os.getenv("METRICS_ENABLED", "1") != "0"
+
+_state = _State()
+
+def set_enabled(enabled):
+    """Turn recording on or off; when off every record call returns at once"""
+    _state.enabled = bool(enabled)
+
+def enabled():
+    return _state.enabled
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+def _format_value(value):
+    if isinstance(value, bool):
+        value = int(value)
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not _state.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not _state.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket counts, then sum and count
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, counts in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key + (("le", _format_value(float(bound))),), cumulative))
+                samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), counts[-1]))
+                samples.append((f"{self.name}_sum", key, counts[-2]))
+                samples.append((f"{self.name}_count", key, counts[-1]))
+        return samples
+
+class Registry:
+    """Named metrics plus collectors that report gauges when scraped
+
+    A collector is a callable returning (name, help, [(labels dict, value)])
+    tuples; it is how existing stats() methods are exposed without
+    changing their owners.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            return metric
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, buckets)
+
+    def register_collector(self, collector):
+        """Add a callable run on every scrape, see stats_collector"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for collector in collectors:
+            try:
+                gauges = collector()
+            except Exception as e:
+                lines.append(f"# collector failed: {_escape(e)}")
+                continue
+            for name, help, values in gauges:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in values:
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+class RequestTimings:
+    """Stage durations of one request, for a Server-Timing header"""
+
+    def __init__(self):
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def header(self):
+        with self._lock:
+            return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items())
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def record_span(name, seconds):
+    """Add time to the current request's Server-Timing entry, if one is being collected"""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+class span:
+    """Time a block into a histogram and the current request's timings"""
+
+    __slots__ = ("histogram", "name", "labels", "start")
+
+    def __init__(self, histogram, name, **labels):
+        self.histogram = histogram
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter() if _state.enabled else None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is None:
+            return False
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(elapsed, **self.labels)
+        record_span(self.name, elapsed)
+        return False
+
+def stats_collector(prefix, stats):
+    """Collector exposing every number in a stats() dict as a gauge named prefix_<key>"""
+    def collect():
+        return [
+            (f"{prefix}_{key}", f"{key.replace('_', ' ')} ({prefix})", [({}, value)])
+            for key, value in stats().items()
+            if isinstance(value, (int, float))
+        ]
+    return collect
+
+def timed_view(histogram, name, server_timing=False):
+    """Decorator observing a view's latency, labelled view=name
+
+    Spans recorded while the view runs, including from worker threads and
+    tasks started from its context, are summed per stage; with
+    server_timing=True they are returned in a Server-Timing header.
+    """
+    def finish(timings, start, response):
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, view=name)
+        if server_timing and response is not None:
+            timings.add("total", elapsed)
+            response["Server-Timing"] = timings.header()
+        return response
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                if not _state.enabled:
+                    return await view(*args, **kwargs)
+                timings = RequestTimings()
+                token = _request_timings.set(timings)
+                start = time.perf_counter()
+                try:
+                    return finish(timings, start, await view(*args, **kwargs))
+                finally:
+                    _request_timings.reset(token)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return view(*args, **kwargs)
+            timings = RequestTimings()
+            token = _request_timings.set(timings)
+            start = time.perf_counter()
+            try:
+                return finish(timings, start, view(*args, **kwargs))
+            finally:
+                _request_timings.reset(token)
+        return wrapper
+    return decorator
@@ -1,3 +1,150 @@
+import argparse
+import bisect
+import csv
+
+# numpy is only needed for batch scoring and imported there, so the
+# interactive questionnaire runs without it
+
+QUESTION_COLUMNS = [f"q{number}" for number in range(1, 10)]
+
+# Lowest total score of each severity level after the first
+SEVERITY_BOUNDS = [5, 10, 15, 20]
+SEVERITY_LEVELS = [
+    "Minimal depression",
+    "Mild depression",
+    "Moderate depression",
+    "Moderately severe depression",
+    "Severe depression"
+]
+
+DIFFICULTY_LEVELS = [
+    "Not difficult at all",
+    "Somewhat difficult",
+    "Very difficult",
+    "Extremely difficult"
+]
+
+RESULT_COLUMNS = [
+    "total_score", "severity", "nearly_every_day", "core_symptoms",
+    "potential_major_depression", "potential_other_depression"
+]
+
+def severity_level(total_score):
+    """Severity level of one total score"""
+    return SEVERITY_LEVELS[bisect.bisect_right(SEVERITY_BOUNDS, total_score)]
+
+def checked_scores(values, highest, name):
+    """values as an int8 array, after checking they are whole numbers from 0 to highest
+
+    The check runs before narrowing: casting 259 to int8 would wrap it to 3.
+    """
+    import numpy as np
+
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        if not np.array_equal(values, np.round(values)):
+            raise ValueError(f"{name} must be whole numbers")
+    elif values.dtype.kind not in "iu":
+        raise ValueError(f"{name} must be numbers, got {values.dtype}")
+    values = values.astype(np.int64)
+    if values.size and (values.min() < 0 or values.max() > highest):
+        raise ValueError(f"{name} must be from 0 to {highest}")
+    return values.astype(np.int8)
+
+def score_batch(responses, difficulty=None):
+    """Score many PHQ-9 questionnaires at once
+
+    responses is an N x 9 array-like of item scores (0-3), one row per
+    respondent; difficulty, if given, holds one functional difficulty level
+    (0-3) per respondent. Returns a dict of length-N arrays, computed with
+    the same rules as PHQ9Assessment.calculate_score.
+    """
+    import numpy as np
+
+    responses = checked_scores(responses, 3, "Responses")
+    if responses.ndim != 2 or responses.shape[1] != len(QUESTION_COLUMNS):
+        raise ValueError(f"Expected an N x {len(QUESTION_COLUMNS)} response matrix, got shape {responses.shape}")
+
+    total_score = responses.sum(axis=1, dtype=np.int16)
+    # Severity level of each total, without looping over the score ranges
+    severity = np.array(SEVERITY_LEVELS)[np.searchsorted(SEVERITY_BOUNDS, total_score, side="right")]
+
+    # Major Depressive Disorder criteria: items at "Nearly every day", with question 1 or 2 among them
+    nearly_every_day = (responses == 3).sum(axis=1, dtype=np.int8)
+    core_symptoms = (responses[:, 0] == 3) | (responses[:, 1] == 3)
+
+    results = {
+        "total_score": total_score,
+        "severity": severity,
+        "nearly_every_day": nearly_every_day,
+        "core_symptoms": core_symptoms,
+        "potential_major_depression": core_symptoms & (nearly_every_day >= 5),
+        "potential_other_depression": core_symptoms & (nearly_every_day >= 2) & (nearly_every_day <= 4)
+    }
+
+    if difficulty is not None:
+        difficulty = checked_scores(difficulty, len(DIFFICULTY_LEVELS) - 1, "Difficulty levels")
+        if difficulty.shape != (len(responses),):
+            raise ValueError("Expected one difficulty level per respondent")
+        results["difficulty_level"] = np.array(DIFFICULTY_LEVELS)[difficulty]
+    return results
+
+def read_responses(path):
+    """Read questionnaires from a CSV with columns q1 to q9, optionally id and difficulty
+
+    Returns (ids, responses, difficulty); respondents without an id column
+    are numbered from 1 and difficulty is None when the column is absent.
+    Scores are returned as read, score_batch checks their range.
+    """
+    import numpy as np
+
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader, [])]
+        missing = [column for column in QUESTION_COLUMNS if column not in header]
+        if missing:
+            raise ValueError(f"Missing columns in {path}: {', '.join(missing)}")
+
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            # A stray field would otherwise shift every later score into the wrong column
+            if len(row) != len(header):
+                raise ValueError(
+                    f"{path} line {reader.line_num}: expected {len(header)} fields, got {len(row)}"
+                )
+            rows.append(row)
+    rows = np.array(rows, dtype=str).reshape(len(rows), len(header))
+
+    try:
+        responses = np.char.strip(rows[:, [header.index(column) for column in QUESTION_COLUMNS]]).astype(np.int64)
+        difficulty = None
+        if "difficulty" in header:
+            difficulty = np.char.strip(rows[:, header.index("difficulty")]).astype(np.int64)
+    except ValueError as e:
+        raise ValueError(f"Non-numeric score in {path}: {e}")
+
+    if "id" in header:
+        ids = rows[:, header.index("id")]
+    else:
+        ids = np.arange(1, len(rows) + 1).astype(str)
+    return ids, responses, difficulty
+
+def write_results(path, ids, results):
+    """Write one CSV row of scores per respondent"""
+    columns = RESULT_COLUMNS + (["difficulty_level"] if "difficulty_level" in results else [])
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id"] + columns)
+        writer.writerows(zip(ids.tolist(), *(results[column].tolist() for column in columns)))
+
+def score_csv(input_path, output_path):
+    """Score every questionnaire in input_path and write the results to output_path"""
+    ids, responses, difficulty = read_responses(input_path)
+    write_results(output_path, ids, score_batch(responses, difficulty))
+    return len(ids)
+
 class PHQ9Assessment:
     def __init__(self):
         self.questions = [
@@ -19,20 +166,9 @@ class PHQ9Assessment:
             3: "Nearly every day"
         }
         
-        self.difficulty_levels = [
-            "Not difficult at all",
-            "Somewhat difficult",
-            "Very difficult",
-            "Extremely difficult"
-        ]
-        
-        self.severity_levels = {
-            range(0, 5): "Minimal depression",
-            range(5, 10): "Mild depression",
-            range(10, 15): "Moderate depression",
-            range(15, 20): "Moderately severe depression",
-            range(20, 28): "Severe depression"
-        }
+        # Levels come from the module tables shared with batch scoring; severity
+        # is looked up through severity_level
+        self.difficulty_levels = DIFFICULTY_LEVELS
         
         self.responses = []
         self.difficulty_response = None
@@ -81,26 +217,17 @@ class PHQ9Assessment:
         """Calculates the total score and returns diagnostic information."""
         total_score = sum(self.responses)
         
-        # Determine severity level
-        severity = None
-        for score_range, level in self.severity_levels.items():
-            if total_score in score_range:
-                severity = level
-        
-        # Check for Major Depressive Disorder criteria
+        # Check for Major Depressive Disorder criteria, as score_batch does
         count_of_threes = sum(1 for score in self.responses if score == 3)
         has_core_symptoms = self.responses[0] == 3 or self.responses[1] == 3  # Questions 1 or 2
         
-        major_depression_criteria = count_of_threes >= 5 and has_core_symptoms
-        other_depression_criteria = (2 <= count_of_threes <= 4) and has_core_symptoms
-        
         return {
             'total_score': total_score,
-            'severity': severity,
+            'severity': severity_level(total_score),
             'responses': self.responses,
             'difficulty_level': self.difficulty_levels[self.difficulty_response],
-            'potential_major_depression': major_depression_criteria,
-            'potential_other_depression': other_depression_criteria
+            'potential_major_depression': count_of_threes >= 5 and has_core_symptoms,
+            'potential_other_depression': (2 <= count_of_threes <= 4) and has_core_symptoms
         }
 
     def generate_report(self):
@@ -134,6 +261,16 @@ class PHQ9Assessment:
         return report
 
 def main():
+    parser = argparse.ArgumentParser(description="PHQ-9 depression screening")
+    parser.add_argument("input", nargs="?", help="CSV of questionnaires to score instead of asking interactively")
+    parser.add_argument("output", nargs="?", default="phq9_scores.csv", help="where to write the scores")
+    args = parser.parse_args()
+
+    if args.input:
+        count = score_csv(args.input, args.output)
+        print(f"Scored {count} questionnaires into {args.output}")
+        return
+
     assessment = PHQ9Assessment()
     assessment.conduct_assessment()
     print(assessment.generate_report())
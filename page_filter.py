@@ -0,0 +1,90 @@
+# Drop blank and repeated pages of a rendered report before they are sent to the model
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Fraction of a page's pixels that must be ink for it to count as content
+DEFAULT_MIN_INK = float(os.getenv("PAGE_FILTER_MIN_INK", "0.001"))
+
+# Pages are measured on a grayscale copy with this longest edge
+MEASURE_EDGE = 512
+# Scanner shadows and punch holes live in the margins, which are left out of the ink count
+MARGIN = 0.04
+# A pixel is ink when it is this much darker than the paper
+INK_CONTRAST = 48
+
+def grayscale(image, max_edge=MEASURE_EDGE):
+    """Downsampled grayscale copy of a page as a uint8 array"""
+    factor = max(1, -(-max(image.size) // max_edge))
+    if factor > 1:
+        # Integer box reduction is much cheaper than resizing the full page
+        image = image.reduce(factor)
+    return np.asarray(image.convert("L"))
+
+def ink_coverage(gray):
+    """Fraction of the page inside the margins darker than the paper"""
+    height, width = gray.shape
+    top, left = int(height * MARGIN), int(width * MARGIN)
+    inner = gray[top:height - top, left:width - left]
+    if inner.size == 0:
+        return 0.0
+    # The paper is the bright end of the page, whatever the scan's exposure
+    paper = np.percentile(inner, 90)
+    return float(np.count_nonzero(inner < paper - INK_CONTRAST)) / inner.size
+
+def page_digest(image):
+    """Digest of a rendered page's pixels; equal only for pages that render identically"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.size}".encode("ascii"))
+    digest.update(image.tobytes())
+    return digest.digest()
+
+def filter_pages(pages, page_numbers, skipped=None, min_ink=DEFAULT_MIN_INK):
+    """Yield the pages worth analyzing, dropping blank pages and repeats
+
+    pages are PIL images or page text (str), as from iter_pdf_pages. A page
+    is blank when almost none of it is ink. A page is only dropped as a
+    repeat when it renders to exactly the same pixels, or for text pages the
+    same text, as an earlier page. Pages that share a lab report layout
+    differ in a few digits, which no downsampled comparison can tell apart
+    reliably, so near-duplicates such as a sheet scanned twice are kept.
+
+    The 1-based number of every page yielded is appended to page_numbers,
+    and {"page", "reason", "duplicate_of"} to skipped, if given, for every
+    page dropped, as the pages are consumed. Skipped pages are also logged.
+    """
+    seen_texts = {}
+    seen_images = {}
+    for page_number, page in enumerate(pages, 1):
+        if isinstance(page, str):
+            duplicate_of = seen_texts.setdefault(page, page_number)
+            if duplicate_of != page_number:
+                skip(skipped, page_number, "duplicate", duplicate_of)
+                continue
+            page_numbers.append(page_number)
+            yield page
+            continue
+
+        gray = grayscale(page)
+        if ink_coverage(gray) < min_ink:
+            skip(skipped, page_number, "blank")
+            continue
+
+        duplicate_of = seen_images.setdefault(page_digest(page), page_number)
+        if duplicate_of != page_number:
+            skip(skipped, page_number, "duplicate", duplicate_of)
+            continue
+        page_numbers.append(page_number)
+        yield page
+
+def skip(skipped, page_number, reason, duplicate_of=None):
+    if duplicate_of is None:
+        logger.info("Skipping page %s: %s", page_number, reason)
+    else:
+        logger.info("Skipping page %s: %s of page %s", page_number, reason, duplicate_of)
+    if skipped is not None:
+        skipped.append({"page": page_number, "reason": reason, "duplicate_of": duplicate_of})
@@ -0,0 +1,147 @@
+# Multi-process page rasterization with PyMuPDF
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+try:
+    from .dispatch import DEFAULT_MAX_IN_FLIGHT
+except ImportError:
+    from dispatch import DEFAULT_MAX_IN_FLIGHT
+
+DEFAULT_WORKERS = int(os.getenv("RASTER_WORKERS", str(os.cpu_count() or 1)))
+DEFAULT_PAGES_PER_TASK = int(os.getenv("RASTER_PAGES_PER_TASK", "2"))
+# Below this many pages the pool round trip costs more than it saves
+DEFAULT_MIN_PAGES = int(os.getenv("RASTER_MIN_PAGES", "4"))
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def get_pool(workers=None):
+    """Process pool shared by every request in this process
+
+    The pool is sized by the first caller and reused afterwards, until a
+    worker dies and breaks it, see discard_pool.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None:
+            _pool_workers = workers or DEFAULT_WORKERS
+            # spawn: forking a threaded web worker is not safe
+            _pool = ProcessPoolExecutor(
+                max_workers=_pool_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+def discard_pool(pool):
+    """Drop a broken pool so the next get_pool builds a new one
+
+    Once a worker is killed (out of memory, SIGBUS on a full /dev/shm) the
+    executor refuses every later task, which would fail every scanned PDF
+    for the rest of the process.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _render_range(pdf_path, page_numbers, dpi):
+    """Worker: render pages into shared memory and return their descriptors
+
+    Ownership of each shared memory block passes to the parent, which
+    unlinks it once the pixels have been read.
+    """
+    descriptors = []
+    document = fitz.open(pdf_path)
+    try:
+        for page_num in page_numbers:
+            pix = document[page_num].get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
+            size = pix.stride * pix.height
+            block = shared_memory.SharedMemory(create=True, size=size)
+            block.buf[:size] = pix.samples_mv
+            descriptors.append((page_num, block.name, pix.width, pix.height, pix.stride))
+            block.close()
+    except Exception:
+        _release(descriptors)
+        raise
+    finally:
+        document.close()
+    return descriptors
+
+def _load(descriptor):
+    """Build a PIL image from a worker's shared memory block and free the block"""
+    _, name, width, height, stride = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        with block.buf[:stride * height] as pixels:
+            return Image.frombytes("RGB", (width, height), pixels, "raw", "RGB", stride)
+    finally:
+        block.close()
+        block.unlink()
+
+def _release(descriptors):
+    for _, name, _, _, _ in descriptors:
+        try:
+            block = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        block.close()
+        block.unlink()
+
+def render_pages_parallel(pdf_bytes, page_numbers, dpi=300, workers=None, pages_per_task=None, lookahead=None):
+    """Yield (page_number, image) for page_numbers in order, rendered across processes
+
+    The PDF is written to a temporary file that each worker opens itself, so
+    the document bytes are not pickled per task. Pixel data comes back
+    through shared memory instead of the result pipe. Rendering runs at
+    most lookahead pages ahead of the consumer; it defaults to the pages the
+    model dispatch holds plus one per worker, so memory and /dev/shm use
+    follow how fast pages are consumed rather than the core count.
+    """
+    pages_per_task = max(1, pages_per_task or DEFAULT_PAGES_PER_TASK)
+    page_numbers = list(page_numbers)
+    ranges = deque(
+        page_numbers[start:start + pages_per_task]
+        for start in range(0, len(page_numbers), pages_per_task)
+    )
+
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        f.write(pdf_bytes)
+
+    pool = get_pool(workers)
+    if lookahead is None:
+        lookahead = DEFAULT_MAX_IN_FLIGHT + _pool_workers
+    in_flight = max(1, -(-lookahead // pages_per_task))
+    pending = deque()
+    ready = deque()
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < in_flight:
+                pending.append(pool.submit(_render_range, pdf_path, ranges.popleft(), dpi))
+            ready.extend(pending.popleft().result())
+            while ready:
+                descriptor = ready.popleft()
+                yield descriptor[0], _load(descriptor)
+    except BrokenProcessPool:
+        discard_pool(pool)
+        raise
+    finally:
+        # Consumer stopped early or a worker failed: free what was rendered
+        _release(ready)
+        for future in pending:
+            try:
+                _release(future.result())
+            except Exception:
+                pass
+        os.remove(pdf_path)
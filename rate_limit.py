@@ -0,0 +1,342 @@
+# Process-wide limits for Gemini calls: token bucket, adaptive concurrency and a retry budget
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+try:
+    from .metrics import registry, span
+except ImportError:
+    from metrics import registry, span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = float(os.getenv("GEMINI_RATE_PER_SECOND", "5"))
+DEFAULT_BURST = int(os.getenv("GEMINI_RATE_BURST", "10"))
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+DEFAULT_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+# Retries allowed per call made, on top of a small steady allowance
+DEFAULT_RETRY_RATIO = float(os.getenv("GEMINI_RETRY_BUDGET", "0.2"))
+DEFAULT_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))
+DEFAULT_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "20"))
+
+THROTTLE_ERRORS = {"ResourceExhausted", "TooManyRequests"}
+TRANSIENT_ERRORS = {"ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "GatewayTimeout"}
+
+def is_throttle(error):
+    """Whether Gemini rejected the call for quota (HTTP 429)"""
+    return getattr(error, "code", None) == 429 or type(error).__name__ in THROTTLE_ERRORS
+
+def is_retryable(error):
+    """Throttling and transient server errors are worth another try"""
+    return (
+        is_throttle(error)
+        or getattr(error, "code", None) in (500, 503, 504)
+        or type(error).__name__ in TRANSIENT_ERRORS
+    )
+
+class TokenBucket:
+    """Allows rate calls per second on average and bursts of up to burst"""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how long to wait before using it"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+class AdaptiveConcurrency:
+    """AIMD limit on calls in flight
+
+    Every success raises the limit by 1/limit, about one per round of calls;
+    a throttled call halves it. Decreases closer together than cooldown
+    seconds count once, so a burst of 429s from one overload does not
+    collapse the limit to the minimum.
+    """
+
+    def __init__(self, max_limit=DEFAULT_MAX_CONCURRENCY, min_limit=1, initial=None,
+                 decrease=0.5, cooldown=1.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial or max_limit)
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        # (loop, future) of coroutines waiting in aacquire
+        self._waiters = deque()
+
+    def try_acquire(self):
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def aacquire(self):
+        """acquire() for coroutines: waits on a future that release() resolves"""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            await future
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, deque()
+        # Like notify_all, every waiter wakes and checks the limit again
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # The waiter's loop has closed
+                pass
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+class RetryBudget:
+    """Caps retries at ratio times the calls made plus min_per_second
+
+    Without a budget every caller retries during an outage and the retries
+    alone keep the quota exhausted.
+    """
+
+    def __init__(self, ratio=DEFAULT_RETRY_RATIO, min_per_second=0.5, max_balance=20):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self._balance = float(max_balance)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount=0.0):
+        now = time.monotonic()
+        self._balance = min(
+            self.max_balance,
+            self._balance + amount + (now - self._updated) * self.min_per_second
+        )
+        self._updated = now
+
+    def record_call(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def try_retry(self):
+        with self._lock:
+            self._refill()
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+class ModelLimiter:
+    """Runs model calls through the bucket, the concurrency limit and retries
+
+    Counters in stats(): calls made, attempts delayed locally by the limits,
+    attempts Gemini throttled, retries, calls given up after retries or when
+    the budget ran out, and calls failed with a non-retryable error.
+    """
+
+    def __init__(self, bucket=None, concurrency=None, budget=None, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX):
+        self.bucket = bucket or TokenBucket()
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.budget = budget or RetryBudget()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._counts = {
+            "calls": 0, "delayed": 0, "throttled": 0, "retried": 0, "gave_up": 0, "failed": 0
+        }
+        self._wait_seconds = 0.0
+
+    def _count(self, name, wait=0.0):
+        with self._lock:
+            self._counts[name] += 1
+            self._wait_seconds += wait
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _should_retry(self, error, attempt):
+        """Record a failed attempt and decide whether to try again"""
+        if is_throttle(error):
+            self._count("throttled")
+        if not is_retryable(error):
+            self._count("failed")
+            return False
+        if attempt >= self.max_retries or not self.budget.try_retry():
+            self._count("gave_up")
+            logger.warning("Giving up on Gemini call after %d attempts: %s", attempt + 1, error)
+            return False
+        self._count("retried")
+        return True
+
+    def _acquire(self):
+        start = time.monotonic()
+        delay = self.bucket.reserve()
+        if delay:
+            time.sleep(delay)
+        self.concurrency.acquire()
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            self._count("delayed", waited)
+
+    async def _aacquire(self):
+        start = time.monotonic()
+        delay = self.bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        await self.concurrency.aacquire()
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            self._count("delayed", waited)
+
+    def call(self, fn, *args, **kwargs):
+        self._count("calls")
+        self.budget.record_call()
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.concurrency.release(throttled=is_throttle(e))
+                if not self._should_retry(e, attempt):
+                    raise
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            self.concurrency.release()
+            return result
+
+    async def acall(self, fn, *args, **kwargs):
+        self._count("calls")
+        self.budget.record_call()
+        attempt = 0
+        while True:
+            await self._aacquire()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                self.concurrency.release(throttled=is_throttle(e))
+                if not self._should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            self.concurrency.release()
+            return result
+
+    def stream(self, fn, *args, **kwargs):
+        """Like call() for streaming responses, yielding chunks
+
+        The concurrency slot is released once the first chunk arrives: the
+        call has been accepted by then, and the rest arrives as fast as the
+        consumer reads it, which may be a user watching the answer render or
+        a stream that is abandoned. Errors are only retried before the first
+        chunk, later ones would duplicate output.
+        """
+        self._count("calls")
+        self.budget.record_call()
+        attempt = 0
+        while True:
+            self._acquire()
+            held = True
+            try:
+                for chunk in fn(*args, **kwargs):
+                    if held:
+                        self.concurrency.release()
+                        held = False
+                    yield chunk
+                return
+            except Exception as e:
+                if not held:
+                    raise
+                held = False
+                self.concurrency.release(throttled=is_throttle(e))
+                if not self._should_retry(e, attempt):
+                    raise
+            finally:
+                if held:
+                    self.concurrency.release()
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts, wait_seconds=self._wait_seconds)
+        stats["concurrency_limit"] = int(self.concurrency.limit)
+        stats["in_flight"] = self.concurrency.in_flight
+        return stats
+
+model_call_seconds = registry.histogram(
+    "gemini_call_seconds", "Gemini generate calls, including rate limit waits and retries"
+)
+
+class LimitedModel:
+    """GenerativeModel wrapper sending every generate call through a ModelLimiter
+
+    Non-streaming calls are timed into gemini_call_seconds; streams are timed
+    by their callers, which see when the last chunk arrives.
+    """
+
+    def __init__(self, model, limiter):
+        self._model = model
+        self._limiter = limiter
+        self._model_name = getattr(model, "model_name", "")
+
+    def generate_content(self, *args, **kwargs):
+        if kwargs.get("stream"):
+            return self._limiter.stream(self._model.generate_content, *args, **kwargs)
+        with span(model_call_seconds, "model", model=self._model_name):
+            return self._limiter.call(self._model.generate_content, *args, **kwargs)
+
+    async def generate_content_async(self, *args, **kwargs):
+        with span(model_call_seconds, "model", model=self._model_name):
+            return await self._limiter.acall(self._model.generate_content_async, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+default_limiter = ModelLimiter()
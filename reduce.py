@@ -0,0 +1,160 @@
+# Tree reduction of page analyses into one document-level analysis
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .dedup import dedupe
+    from .report_cache import content_hash
+    from .report_schema import SECTIONS, LIST, extract_json
+except ImportError:
+    from dedup import dedupe
+    from report_cache import content_hash
+    from report_schema import SECTIONS, LIST, extract_json
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FANOUT = int(os.getenv("REDUCE_FANOUT", "4"))
+DEFAULT_WORKERS = int(os.getenv("REDUCE_WORKERS", "4"))
+# Bump when REDUCE_PROMPT changes so cached merges are not reused
+REDUCE_VERSION = "reduce-v1"
+
+REDUCE_PROMPT = """
+You are combining analyses of consecutive parts of one medical report into a single analysis.
+Write in {language}, in plain language that a non-medical reader can understand.
+Weigh abnormal results and concerns above normal ones and do not add findings that are not listed.
+
+{parts}
+
+Respond with JSON: {{"overall_status": "overall health status for the whole report in one or two sentences",
+"summary": "a brief, simple explanation of the whole report in 2-3 sentences"}}
+"""
+
+STATUS_SCHEMA = {
+    "type": "object",
+    "properties": {"overall_status": {"type": "string"}, "summary": {"type": "string"}},
+    "required": ["overall_status", "summary"]
+}
+
+# Items of each list quoted to the model per part; the lists themselves are merged locally
+PROMPT_ITEMS = 5
+FALLBACK_SUMMARY_CHARS = 600
+
+def analysis_hash(analysis):
+    """Content hash of a page analysis, the leaf key of the reduce tree"""
+    return content_hash(b"analysis", json.dumps(analysis, sort_keys=True, ensure_ascii=False))
+
+def merge_lists(children):
+    """Concatenate the list fields of children in order, merging near-duplicates"""
+    merged = {}
+    for section, fields in SECTIONS.items():
+        merged[section] = {}
+        for field, kind in fields.items():
+            if kind == LIST:
+                merged[section][field] = dedupe([
+                    item for child in children for item in child.get(section, {}).get(field, [])
+                ])
+    return merged
+
+def describe_part(number, child):
+    assessment = child.get("health_assessment", {})
+    lines = [f"Part {number}:"]
+    if assessment.get("overall_status"):
+        lines.append(f"- Status: {assessment['overall_status']}")
+    concerns = assessment.get("areas_of_concern", [])[:PROMPT_ITEMS]
+    if concerns:
+        lines.append(f"- Concerns: {'; '.join(concerns)}")
+    abnormal = child.get("test_results", {}).get("abnormal_values", [])[:PROMPT_ITEMS]
+    if abnormal:
+        lines.append(f"- Abnormal results: {'; '.join(abnormal)}")
+    if child.get("summary"):
+        lines.append(f"- Summary: {child['summary']}")
+    return "\n".join(lines)
+
+def first_sentence(text):
+    match = re.match(r"(.+?[.!?])(\s|$)", text.strip())
+    return match.group(1) if match else text.strip()
+
+def local_status(children):
+    """Status and summary without a model: the distinct child statements, shortened"""
+    statuses = dedupe([
+        child.get("health_assessment", {}).get("overall_status", "") for child in children
+    ])
+    summaries = dedupe([first_sentence(child.get("summary", "")) for child in children])
+    summary = " ".join(text for text in summaries if text)
+    if len(summary) > FALLBACK_SUMMARY_CHARS:
+        summary = summary[:FALLBACK_SUMMARY_CHARS - 3].rsplit(" ", 1)[0] + "..."
+    return "; ".join(text for text in statuses if text), summary
+
+def merge_analyses(children, model=None, language="English"):
+    """Merge sibling analyses into their parent; returns (analysis, cacheable)
+
+    List fields are merged locally. The overall status and summary are
+    written by the model from the children's; if there is no model or the
+    call fails they are stitched together locally and the result is not
+    cacheable, so a later run can still get the model's version.
+    """
+    merged = merge_lists(children)
+    cacheable = True
+    status = summary = None
+    if model is not None:
+        prompt = REDUCE_PROMPT.format(
+            language=language,
+            parts="\n\n".join(describe_part(number, child) for number, child in enumerate(children, 1))
+        )
+        try:
+            response = model.generate_content(
+                prompt,
+                generation_config={"response_mime_type": "application/json", "response_schema": STATUS_SCHEMA}
+            )
+            data = extract_json(response.text, lambda value: isinstance(value, dict) and "summary" in value)
+            status = str(data.get("overall_status", "")).strip()
+            summary = str(data.get("summary", "")).strip()
+        except Exception as e:
+            logger.warning("Reduce step fell back to a local summary: %s", e)
+    if not summary:
+        status, summary = local_status(children)
+        cacheable = False
+
+    merged["health_assessment"]["overall_status"] = status
+    merged["summary"] = summary
+    return merged, cacheable
+
+def reduce_tree(leaves, merge, fanout=DEFAULT_FANOUT, max_workers=DEFAULT_WORKERS, cache=None, key_parts=()):
+    """Reduce leaves to one value by merging groups of fanout siblings level by level
+
+    merge(children) returns (value, cacheable). All merges of a level run
+    concurrently, so the time grows with the tree depth, log_fanout(len(leaves)),
+    rather than the page count. With a cache, each node is stored under a hash
+    of its children's hashes and key_parts: when one page changes only the
+    merges on its path up the tree are redone.
+    """
+    if not leaves:
+        raise ValueError("Nothing to reduce")
+    fanout = max(2, fanout)
+    # (hash, value, cacheable); a merge built on an uncached fallback is not cached either
+    nodes = [(analysis_hash(leaf), leaf, True) for leaf in leaves]
+
+    def reduce_group(group):
+        if len(group) == 1:
+            # Odd one out at the end of a level moves up unchanged
+            return group[0]
+        key = content_hash(b"reduce", REDUCE_VERSION, *map(str, key_parts), *(node[0] for node in group))
+        cacheable = all(node[2] for node in group)
+        if cache is not None and cacheable:
+            cached = cache.get(key)
+            if cached is not None:
+                return key, cached, True
+        value, merged_cacheable = merge([node[1] for node in group])
+        cacheable = cacheable and merged_cacheable
+        if cache is not None and cacheable:
+            cache.set(key, value)
+        return key, value, cacheable
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while len(nodes) > 1:
+            groups = [nodes[start:start + fanout] for start in range(0, len(nodes), fanout)]
+            nodes = list(executor.map(reduce_group, groups))
+    return nodes[0][1]
@@ -0,0 +1,80 @@
+# In-memory LRU of the encoded pages of recent uploads
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+class RenderCache:
+    """(page_number, part) pairs per document, evicted least recently used beyond max_bytes
+
+    Pages are kept encoded rather than as decoded images: a 200 DPI page is
+    about 10 MB as pixels but a few hundred KB as PNG, and the encoded parts
+    are exactly what the model and the page cache keys need.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached pages for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, pages):
+        pages = list(pages)
+        size = sum(len(part["data"]) for _, part in pages)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._entries[key] = (pages, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.evictions += 1
+
+    def collect(self, key, pages):
+        """Pass pages through as they are produced and cache them once all have been
+
+        A document that fails or is abandoned half way is not cached, and one
+        larger than max_bytes stops being collected as soon as it exceeds it.
+        """
+        collected = []
+        size = 0
+        for page in pages:
+            if collected is not None:
+                size += len(page[1]["data"])
+                collected.append(page)
+                if size > self.max_bytes:
+                    collected = None
+            yield page
+        if collected is not None:
+            self.set(key, collected)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
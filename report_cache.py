@@ -0,0 +1,148 @@
+# Content-addressed on-disk cache for medical report analyses
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", ".report_cache")
+DEFAULT_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_MB", "256")) * 1024 * 1024
+DEFAULT_TTL = int(os.getenv("REPORT_CACHE_TTL", str(7 * 24 * 3600)))
+
+def content_hash(*parts):
+    """Hash a sequence of bytes/str parts into a hex digest"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # Length prefix keeps ("ab", "c") and ("a", "bc") apart
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+def report_key(pdf_bytes, language, prompt_version):
+    """Cache key for the combined analysis of a whole PDF"""
+    return content_hash(b"report", pdf_bytes, language, str(prompt_version))
+
+def page_key(page_data, language, prompt_version):
+    """Cache key for the analysis of a single encoded page"""
+    return content_hash(b"page", page_data, language, str(prompt_version))
+
+class ReportCache:
+    """JSON values stored one file per key with size/TTL based LRU eviction
+
+    Recency is tracked through file mtimes, so the cache can be shared by
+    several worker processes pointing at the same directory.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total_bytes = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if self.ttl and time.time() - record.get("created", 0) > self.ttl:
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            # Mark as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return record.get("value")
+
+    def set(self, key, value):
+        """Store value under key, evicting old entries if over budget"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"created": time.time(), "value": value}, ensure_ascii=False)
+
+        # Write to a temporary file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(data.encode("utf-8"))
+            over_budget = self._total_bytes is None or self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        entries = []
+        now = time.time()
+        with self._lock:
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if not name.endswith(".json"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    # mtime is never older than creation, so this entry has expired
+                    if self.ttl and now - stat.st_mtime > self.ttl:
+                        self._remove(path)
+                        self.evictions += 1
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                self.evictions += 1
+                total -= size
+            self._total_bytes = total
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        """Hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,191 @@
+# Response schema for page analyses and a tolerant parser for what the model sends back
+import json
+import re
+
+LIST = "list"
+TEXT = "text"
+
+# Section -> field -> kind, as requested in the report prompt
+SECTIONS = {
+    "test_results": {
+        "key_findings": LIST,
+        "abnormal_values": LIST,
+        "normal_values": LIST
+    },
+    "health_assessment": {
+        "overall_status": TEXT,
+        "areas_of_concern": LIST,
+        "positive_indicators": LIST
+    },
+    "recommendations": {
+        "immediate_actions": LIST,
+        "follow_up_tests": LIST,
+        "lifestyle_changes": LIST
+    }
+}
+
+def _field_schema(kind):
+    if kind == LIST:
+        return {"type": "array", "items": {"type": "string"}}
+    return {"type": "string"}
+
+PAGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **{
+            section: {
+                "type": "object",
+                "properties": {field: _field_schema(kind) for field, kind in fields.items()},
+                "required": list(fields)
+            }
+            for section, fields in SECTIONS.items()
+        },
+        "summary": {"type": "string"}
+    },
+    "required": [*SECTIONS, "summary"]
+}
+
+BATCH_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"page": {"type": "integer"}, **PAGE_SCHEMA["properties"]},
+        "required": ["page", *PAGE_SCHEMA["required"]]
+    }
+}
+
+def generation_config(batch=False):
+    """Ask Gemini for JSON that follows the page (or batch) schema"""
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": BATCH_SCHEMA if batch else PAGE_SCHEMA
+    }
+
+TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+def _balanced_end(text, start):
+    """Index just past the bracket closing the one at start, or None"""
+    stack = []
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not stack or stack.pop() != char:
+                return None
+            if not stack:
+                return index + 1
+    return None
+
+def _loads(candidate):
+    try:
+        return json.loads(candidate)
+    except ValueError:
+        # Trailing commas are the most common hand-written JSON slip
+        return json.loads(TRAILING_COMMA.sub(r"\1", candidate))
+
+def iter_json(text):
+    """Every balanced JSON object or array in text that parses, outermost first"""
+    start = 0
+    while True:
+        match = re.search(r"[{\[]", text[start:])
+        if match is None:
+            return
+        begin = start + match.start()
+        end = _balanced_end(text, begin)
+        if end is not None:
+            try:
+                yield _loads(text[begin:end])
+            except ValueError:
+                pass
+        # Nested values are candidates too, e.g. an analysis wrapped in {"result": ...}
+        start = begin + 1
+
+def extract_json(text, accept=None):
+    """First JSON value in text, optionally the first one accept() approves
+
+    Handles code fences, prose before or after the JSON and trailing
+    commas. Raises ValueError if no suitable JSON value is found.
+    """
+    try:
+        value = json.loads(text.strip())
+        if accept is None or accept(value):
+            return value
+    except ValueError:
+        pass
+
+    for value in iter_json(text):
+        if accept is None or accept(value):
+            return value
+    raise ValueError("No JSON analysis found in model response")
+
+def _as_text(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return "; ".join(f"{key}: {_as_text(item)}" for key, item in value.items())
+    if isinstance(value, list):
+        return " ".join(_as_text(item) for item in value)
+    return "" if value is None else str(value)
+
+def _as_list(value):
+    if value is None or value == "":
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    return [text for text in (_as_text(item).strip() for item in value) if text]
+
+def validate_page(data):
+    """Check a page analysis against the schema and coerce it into shape
+
+    Missing fields are filled in empty, list fields hold strings and text
+    fields are strings, so the result can always be combined. Raises
+    ValueError if data is not an analysis at all.
+    """
+    if not _is_analysis(data):
+        raise ValueError("Model response is not a page analysis")
+
+    page = {}
+    for section, fields in SECTIONS.items():
+        values = data.get(section)
+        if not isinstance(values, dict):
+            values = {}
+        page[section] = {
+            field: _as_list(values.get(field)) if kind == LIST else _as_text(values.get(field)).strip()
+            for field, kind in fields.items()
+        }
+    page["summary"] = _as_text(data.get("summary")).strip()
+    if isinstance(data.get("page"), int):
+        page["page"] = data["page"]
+    return page
+
+def _is_analysis(value):
+    return isinstance(value, dict) and any(key in value for key in (*SECTIONS, "summary"))
+
+def _is_batch(value):
+    return isinstance(value, list) and any(_is_analysis(item) for item in value) or (
+        isinstance(value, dict) and isinstance(value.get("pages"), list)
+    )
+
+def parse_page(text):
+    """Parse and validate the analysis of one page"""
+    data = extract_json(text, lambda value: _is_analysis(value) or _is_batch(value))
+    if isinstance(data, list) and len(data) == 1:
+        # Page answered in the batch format
+        data = data[0]
+    return validate_page(data)
+
+def parse_batch(text):
+    """Parse the JSON answer covering several pages, for split_batch_response"""
+    return extract_json(text, lambda value: _is_batch(value) or _is_analysis(value))
@@ -0,0 +1,162 @@
+# Near-duplicate cache of chatbot answers, matched with TF-IDF cosine similarity
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+DEFAULT_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.8"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+DEFAULT_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+
+# Filler and generic "first aid" wording carries no information about which
+# answer is wanted. Negations are kept as a "not" term instead, see get().
+STOPWORDS = set("""
+a an the and or of to in on at for from with by about into after before my me i im i'm we our you your
+is are was were be been being am do does did done doing have has had can could should would will shall may might
+how what when where which who why whats what's please help tell give know need want
+treat treating treated treatment first aid aids remedy remedies advice guide best way ways steps
+this that these those it its there here some any if then so just get got
+someone somebody person people friend
+""".split())
+
+NEGATIONS = {"no", "not", "never", "cannot", "cant", "can't", "dont", "don't", "doesnt", "doesn't", "isnt", "isn't", "wont", "won't"}
+
+def stem(word):
+    """Strip common English suffixes so burn, burns and burned share a term"""
+    if word.endswith("'s"):
+        word = word[:-2]
+    if len(word) > 5 and word.endswith("ing"):
+        return word[:-3]
+    if len(word) > 4 and word.endswith("ed") and not word.endswith("eed"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    # bruise/bruised, choke/choking
+    if len(word) > 4 and word.endswith("e") and not word.endswith("ee"):
+        word = word[:-1]
+    return word
+
+def query_terms(text):
+    """Normalized term counts of a question"""
+    terms = Counter()
+    for word in re.findall(r"[a-z0-9']+", text.lower()):
+        if word in NEGATIONS:
+            terms["not"] += 1
+        elif word not in STOPWORDS:
+            terms[stem(word).strip("'")] += 1
+    return terms
+
+class ResponseCache:
+    """LRU cache of answers served to questions that are worded alike
+
+    Questions are reduced to stemmed content words and compared by TF-IDF
+    cosine similarity, with document frequencies taken from the cached
+    questions themselves. An inverted index limits scoring to entries that
+    share at least one term with the query. Entries expire after ttl seconds
+    and the least recently served one is dropped beyond max_entries.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._postings = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(terms):
+        return " ".join(sorted(terms.elements()))
+
+    def _idf(self, term):
+        document_count = len(self._entries)
+        return math.log((document_count + 1) / (len(self._postings.get(term, ())) + 1)) + 1
+
+    def _similarity(self, terms, other):
+        dot = sum(count * other[term] * self._idf(term) ** 2 for term, count in terms.items() if term in other)
+        if not dot:
+            return 0.0
+        norm = math.sqrt(sum((count * self._idf(term)) ** 2 for term, count in terms.items()))
+        other_norm = math.sqrt(sum((count * self._idf(term)) ** 2 for term, count in other.items()))
+        return dot / (norm * other_norm)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for term in entry["terms"]:
+            postings = self._postings[term]
+            postings.discard(key)
+            if not postings:
+                del self._postings[term]
+
+    def _expired(self, entry, now):
+        return self.ttl and now - entry["created"] > self.ttl
+
+    def get(self, question):
+        """Cached answer to a question close enough to this one, or None"""
+        terms = query_terms(question)
+        now = time.time()
+        with self._lock:
+            candidates = set()
+            for term in terms:
+                candidates.update(self._postings.get(term, ()))
+
+            best_key = None
+            best_score = 0.0
+            for key in candidates:
+                entry = self._entries[key]
+                if self._expired(entry, now):
+                    self._remove(key)
+                    self.evictions += 1
+                    continue
+                # "not breathing" and "breathing" need different answers however
+                # similar the rest of the question is
+                if ("not" in terms) != ("not" in entry["terms"]):
+                    continue
+                score = self._similarity(terms, entry["terms"])
+                if score > best_score:
+                    best_key, best_score = key, score
+
+            if best_key is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key]["answer"]
+
+    def set(self, question, answer):
+        """Remember the answer given to a question"""
+        terms = query_terms(question)
+        if not terms:
+            # Nothing left to match on, e.g. "help me please"
+            return
+        key = self._key(terms)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {"terms": terms, "answer": answer, "created": time.time()}
+            for term in terms:
+                self._postings.setdefault(term, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._postings.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,71 @@
+# Streaming model responses with time-to-first-token tracking
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class StreamStats:
+    """Running totals of streamed response latencies"""
+
+    def __init__(self):
+        self.count = 0
+        self.ttft_total = 0.0
+        self.duration_total = 0.0
+        self.last = None
+        self._lock = threading.Lock()
+
+    def record(self, ttft, duration):
+        with self._lock:
+            self.count += 1
+            if ttft is not None:
+                self.ttft_total += ttft
+            self.duration_total += duration
+            self.last = {"ttft": ttft, "total": duration}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "avg_ttft": self.ttft_total / self.count if self.count else None,
+                "avg_total": self.duration_total / self.count if self.count else None,
+                "last": self.last
+            }
+
+stream_stats = StreamStats()
+
+def stream_text(model, prompt, timings=None, stats=stream_stats):
+    """Yield the response text chunk by chunk as Gemini generates it
+
+    Time to first token and total time, in seconds from the request, are
+    written into timings (if given) once the stream ends and added to
+    stats.
+    """
+    if timings is None:
+        timings = {}
+    start = time.perf_counter()
+    ttft = None
+    try:
+        response = model.generate_content(prompt, stream=True)
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk without text parts, e.g. only safety ratings
+                continue
+            if not text:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            yield text
+    finally:
+        total = time.perf_counter() - start
+        timings["ttft"] = ttft
+        timings["total"] = total
+        if stats is not None:
+            stats.record(ttft, total)
+        logger.info(
+            "Streamed response: first token %s, total %.0f ms",
+            f"{ttft * 1000:.0f} ms" if ttft is not None else "never",
+            total * 1000
+        )
@@ -0,0 +1,68 @@
+# Text-layer extraction for digitally generated PDF pages
+import os
+
+DEFAULT_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "200"))
+DEFAULT_MAX_IMAGE_COVERAGE = float(os.getenv("TEXT_LAYER_MAX_IMAGE_COVERAGE", "0.5"))
+
+def image_coverage(page):
+    """Fraction of the page area covered by embedded images"""
+    page_rect = page.rect
+    page_area = page_rect.width * page_rect.height
+    if not page_area:
+        return 0.0
+
+    covered = 0.0
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        # Clip to the visible page
+        x0, y0 = max(x0, page_rect.x0), max(y0, page_rect.y0)
+        x1, y1 = min(x1, page_rect.x1), min(y1, page_rect.y1)
+        if x1 > x0 and y1 > y0:
+            covered += (x1 - x0) * (y1 - y0)
+    return min(covered / page_area, 1.0)
+
+def layout_words(words):
+    """Rebuild reading order from word boxes, keeping table columns apart
+
+    words are PyMuPDF "words" tuples (x0, y0, x1, y1, text, block, line, word).
+    Words whose vertical centres are close share a row; a wide horizontal gap
+    inside a row becomes " | " so values stay next to their test names.
+    """
+    if not words:
+        return ""
+
+    heights = sorted(w[3] - w[1] for w in words)
+    row_tolerance = max(heights[len(heights) // 2] / 2, 1.0)
+
+    rows = []
+    for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        centre = (word[1] + word[3]) / 2
+        if rows and abs(rows[-1][0] - centre) <= row_tolerance:
+            rows[-1][1].append(word)
+        else:
+            rows.append([centre, [word]])
+
+    lines = []
+    for _, row in rows:
+        row.sort(key=lambda w: w[0])
+        line = row[0][4]
+        for previous, word in zip(row, row[1:]):
+            char_width = (previous[2] - previous[0]) / max(len(previous[4]), 1)
+            gap = word[0] - previous[2]
+            line += " | " if gap > 3 * char_width else " "
+            line += word[4]
+        lines.append(line)
+    return "\n".join(lines)
+
+def extract_text_layer(page, min_chars=DEFAULT_MIN_CHARS, max_image_coverage=DEFAULT_MAX_IMAGE_COVERAGE):
+    """Return the page text laid out compactly, or None if it should be rasterized
+
+    Pages with too little text, or mostly covered by images (scans, scans
+    with an OCR layer, charts), return None.
+    """
+    words = page.get_text("words")
+    if sum(len(w[4]) for w in words) < min_chars:
+        return None
+    if image_coverage(page) > max_image_coverage:
+        return None
+    return layout_words(words)
@@ -0,0 +1,124 @@
+# Local pre-filter that answers clearly non-medical questions without a model call
+import os
+import re
+
+# Distinct off-topic words needed to refuse when no off-topic phrase matched
+DEFAULT_MIN_SIGNALS = int(os.getenv("TOPIC_FILTER_MIN_SIGNALS", "2"))
+
+REFUSAL = (
+    "I'm a medical first aid assistant, so I can only help with health concerns such as "
+    "injuries, symptoms and medication questions. Please describe the medical situation "
+    "and I'll do my best to help. In an emergency, call your local emergency number."
+)
+
+# A word matches a key it equals or, for keys of four or more letters, one
+# it starts with (bleed -> bleeding). Any medical word, body part or
+# medical phrase means the message goes to the model; only messages with
+# several off-topic signals and none of those are refused. This is a
+# first-aid bot, so injuries described through everyday words ("hit by a
+# car", "fell off my bike") count as medical.
+MEDICAL = "medical"
+BODY = "body"
+OFF_TOPIC = "off_topic"
+
+MEDICAL_TERMS = """
+pain hurt ache sore bleed blood burn cut wound scrape graze bruise fever headache migraine cough sneez
+sick ill injur broken fracture sprain strain swell swollen rash itch hive allerg breath asthma inhaler
+chest heart stroke faint dizz vomit nausea nauseous puke poison overdose bite bitten sting stung choke chok cpr
+medic medicine doctor nurse hospital clinic symptom infect diarrh constipat dehydrat seizure convuls
+unconscious concuss emergency ambulance pill tablet dose drug antibiotic paracetamol ibuprofen aspirin
+epipen anaphyla diabet insulin sugar pregnan period cramp flu cold covid virus temperature
+anxiety anxious panic depress suicid stress insomnia sleep tired fatigue numb tingl paralys
+blister splinter sunburn frostbite hypotherm heatstroke shock wheez vision blind deaf
+bandage plaster splint stitch tourniquet ice
+hit crash collaps fell fall fallen swallow accident drown trapped unresponsive
+""".split()
+
+BODY_TERMS = """
+head neck back shoulder arm elbow wrist hand finger leg knee ankle foot feet toe hip eye ear nose
+mouth tooth teeth throat tongue lip skin stomach belly abdomen chest lung kidney liver bone joint
+muscle baby child toddler infant
+""".split()
+
+OFF_TOPIC_TERMS = """
+weather movie film song music lyric album singer celebrity actor actress netflix tv series
+football cricket basketball soccer tennis match tournament team player won
+stock share bitcoin crypto invest loan bank price cost buy sell shopping discount
+code coding python javascript java software laptop computer iphone android website
+homework essay poem story joke riddle translate translation grammar
+capital president prime minister election politic government country population
+recipe cook bake restaurant hotel flight travel vacation holiday visa
+car bike engine game gaming minecraft fortnite chess job resume salary interview
+math equation algebra calculus physics chemistry history geography planet
+""".split()
+
+# Phrases decide on their own: one off-topic phrase is enough to refuse
+PHRASES = {
+    "first aid": MEDICAL,
+    "can't breathe": MEDICAL,
+    "passed out": MEDICAL,
+    "not moving": MEDICAL,
+    "isn't moving": MEDICAL,
+    "not breathing": MEDICAL,
+    "capital of": OFF_TOPIC,
+    "who won": OFF_TOPIC,
+    "write a poem": OFF_TOPIC,
+    "write a story": OFF_TOPIC,
+    "write an essay": OFF_TOPIC,
+    "tell me a joke": OFF_TOPIC,
+    "how much is": OFF_TOPIC,
+    "weather like": OFF_TOPIC,
+    "lyrics to": OFF_TOPIC,
+    "recipe for": OFF_TOPIC,
+    "book me a": OFF_TOPIC,
+}
+
+KINDS = {}
+for _terms, _kind in ((OFF_TOPIC_TERMS, OFF_TOPIC), (BODY_TERMS, BODY), (MEDICAL_TERMS, MEDICAL)):
+    for _term in _terms:
+        KINDS[_term] = _kind
+
+def word_kind(word):
+    """(kind, matched key) of a word, or (None, None)"""
+    kind = KINDS.get(word)
+    if kind is not None:
+        return kind, word
+    for end in range(len(word) - 1, 3, -1):
+        kind = KINDS.get(word[:end])
+        if kind is not None:
+            return kind, word[:end]
+    return None, None
+
+def topic_evidence(text):
+    """Medical evidence count, distinct off-topic words and off-topic phrases in text"""
+    text = text.lower()
+    medical = 0
+    off_topic_words = set()
+    for word in re.findall(r"[a-z']+", text):
+        kind, key = word_kind(word)
+        if kind == OFF_TOPIC:
+            off_topic_words.add(key)
+        elif kind is not None:
+            medical += 1
+    off_topic_phrases = []
+    for phrase, kind in PHRASES.items():
+        if phrase in text:
+            if kind == MEDICAL:
+                medical += 1
+            else:
+                off_topic_phrases.append(phrase)
+    return medical, off_topic_words, off_topic_phrases
+
+def is_off_topic(text, min_signals=DEFAULT_MIN_SIGNALS):
+    """Whether text is clearly not a medical question
+
+    Refused only when nothing in it is medical and it has an off-topic
+    phrase ("capital of", "write a poem") or at least min_signals distinct
+    off-topic words. One stray word ("car", "holiday") is not enough, and
+    input without evidence either way, such as "what about the second
+    one?", is left to the model.
+    """
+    medical, off_topic_words, off_topic_phrases = topic_evidence(text)
+    if medical:
+        return False
+    return bool(off_topic_phrases) or len(off_topic_words) >= min_signals
@@ -1,16 +1,21 @@
 
 # chatbot/utils.py
-import google.generativeai as genai
 import os
+from .gemini_client import get_model
+from .streaming import stream_text
+from .response_cache import ResponseCache
+from .topic_filter import REFUSAL, is_off_topic
+
+# Answers to common questions are reused for near-identical rewordings
+response_cache = ResponseCache()
 
 def setup_gemini():
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         raise ValueError("GOOGLE_API_KEY not found in environment variables")
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-pro')
+    return get_model('gemini-pro', api_key)
 
-def get_bot_response(model, user_input):
+def build_prompt(user_input):
     prompt = """
     You are a medical first aid assistant. Your role is to:
     1. Provide immediate, non-emergency first aid advice
@@ -25,10 +30,56 @@ def get_bot_response(model, user_input):
     User's current concern: {user_input}
     """
     
-    formatted_prompt = prompt.format(user_input=user_input)
+    return prompt.format(user_input=user_input)
+
+def get_bot_response(model, user_input):
+    if is_off_topic(user_input):
+        return REFUSAL
+    cached = response_cache.get(user_input)
+    if cached is not None:
+        return cached
+    formatted_prompt = build_prompt(user_input)
     
     try:
         response = model.generate_content(formatted_prompt)
+        response_cache.set(user_input, response.text)
+        return response.text
+    except Exception as e:
+        return f"I apologize, but I encountered an error: {str(e)}. Please try again."
+
+async def aget_bot_response(model, user_input):
+    """get_bot_response without blocking the event loop on the model call"""
+    if is_off_topic(user_input):
+        return REFUSAL
+    cached = response_cache.get(user_input)
+    if cached is not None:
+        return cached
+    formatted_prompt = build_prompt(user_input)
+    
+    try:
+        response = await model.generate_content_async(formatted_prompt)
+        response_cache.set(user_input, response.text)
         return response.text
     except Exception as e:
         return f"I apologize, but I encountered an error: {str(e)}. Please try again."
+
+def stream_bot_response(model, user_input, timings=None):
+    """Yield the bot response in chunks as the model generates it"""
+    if is_off_topic(user_input):
+        yield REFUSAL
+        return
+    cached = response_cache.get(user_input)
+    if cached is not None:
+        yield cached
+        return
+    formatted_prompt = build_prompt(user_input)
+    
+    try:
+        chunks = []
+        for chunk in stream_text(model, formatted_prompt, timings):
+            chunks.append(chunk)
+            yield chunk
+        # Only complete answers are cached, not ones cut off by an error
+        response_cache.set(user_input, "".join(chunks))
+    except Exception as e:
+        yield f"I apologize, but I encountered an error: {str(e)}. Please try again."
@@ -1,15 +1,26 @@
 
 # chatbot/views.py
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from .utils import setup_gemini, get_bot_response
+from django.conf import settings
+from .utils import setup_gemini, get_bot_response, aget_bot_response, stream_bot_response
+from .metrics import enabled, registry, set_enabled, timed_view
 import json
 
+# Metrics are recorded unless turned off, by this setting or METRICS_ENABLED=0 in
+# the environment; the overhead is then a flag check per call
+set_enabled(getattr(settings, "METRICS_ENABLED", enabled()))
+# Add a Server-Timing header with per-stage durations to instrumented responses
+METRICS_SERVER_TIMING = getattr(settings, "METRICS_SERVER_TIMING", False)
+
+request_seconds = registry.histogram("http_request_seconds", "Time spent in a view, by view")
+
 def chat_view(request):
     return render(request, 'chatbot/chat.html')
 
 @csrf_exempt
+@timed_view(request_seconds, "get_response", METRICS_SERVER_TIMING)
 def get_response(request):
     if request.method == 'POST':
         try:
@@ -36,6 +47,83 @@ def get_response(request):
         'message': 'Invalid request method'
     })
 
+@csrf_exempt
+@timed_view(request_seconds, "aget_response", METRICS_SERVER_TIMING)
+async def aget_response(request):
+    """Async get_response for ASGI deployments"""
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            user_input = data.get('message', '')
+            
+            # Get bot response without holding a thread during the model call
+            model = setup_gemini()
+            bot_response = await aget_bot_response(model, user_input)
+            
+            return JsonResponse({
+                'status': 'success',
+                'response': bot_response
+            })
+            
+        except Exception as e:
+            return JsonResponse({
+                'status': 'error',
+                'message': str(e)
+            })
+    
+    return JsonResponse({
+        'status': 'error',
+        'message': 'Invalid request method'
+    })
+
+def sse_event(data, event=None):
+    """Format one server-sent event"""
+    payload = f"data: {json.dumps(data)}\n\n"
+    if event:
+        payload = f"event: {event}\n{payload}"
+    return payload
+
+@csrf_exempt
+def stream_response(request):
+    """Stream the bot response as server-sent events
+
+    Each chunk arrives as a "data" event carrying {"text": ...}; a final
+    "done" event reports time to first token and total time in ms.
+    """
+    if request.method != 'POST':
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Invalid request method'
+        })
+
+    try:
+        data = json.loads(request.body)
+        user_input = data.get('message', '')
+        model = setup_gemini()
+    except Exception as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        })
+
+    def events():
+        timings = {}
+        for chunk in stream_bot_response(model, user_input, timings):
+            yield sse_event({'text': chunk})
+        # The view itself returns before the model runs, so time the stream here
+        request_seconds.observe(timings.get('total', 0), view='stream_response')
+        ttft = timings.get('ttft')
+        yield sse_event({
+            'ttft_ms': round(ttft * 1000) if ttft is not None else None,
+            'total_ms': round(timings.get('total', 0) * 1000)
+        }, event='done')
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 
 
 
@@ -43,148 +131,461 @@ def get_response(request):
 
 
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
+from asgiref.sync import sync_to_async
 
-import google.generativeai as genai
 import fitz  # PyMuPDF
 import numpy as np
 from PIL import Image
+import asyncio
 import io
 import json
+import logging
 import os
 from dotenv import load_dotenv
+from .dispatch import DEFAULT_MAX_IN_FLIGHT, dispatch_pages, adispatch_pages
+from .report_cache import ReportCache, DEFAULT_CACHE_DIR, report_key, page_key
+from .text_layer import extract_text_layer
+from .encoding import encode_image, get_encoding_profile
+from .batching import batch_pages, batch_prompt, split_batch_response
+from .rasterize import render_pages_parallel, DEFAULT_MIN_PAGES
+from .gemini_client import get_model, warm_up_in_background
+from .jobs import JobQueue, DEFAULT_DB_PATH, DEFAULT_WORKERS
+from .rate_limit import default_limiter
+from .report_schema import generation_config, parse_page, parse_batch, validate_page
+from .reduce import reduce_tree, merge_analyses
+from .page_filter import filter_pages
+from .metrics import registry, span, stats_collector, timed_view, enabled, BYTES_BUCKETS
+from .utils import response_cache
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+GEMINI_MAX_IN_FLIGHT = getattr(settings, "GEMINI_MAX_IN_FLIGHT", None)
+
+# Pages packed into one request (1 disables batching) and the payload budget per request
+GEMINI_BATCH_PAGES = getattr(settings, "GEMINI_BATCH_PAGES", None)
+GEMINI_BATCH_MAX_BYTES = getattr(settings, "GEMINI_BATCH_MAX_BYTES", None)
+
+# Bump whenever the analysis prompt changes so cached analyses are not reused
+PROMPT_VERSION = "report-v4"
+
+# Pages with a usable text layer are sent as text instead of a rendered image
+USE_TEXT_LAYER = getattr(settings, "REPORT_USE_TEXT_LAYER", True)
+
+# Processes used to rasterize scanned pages; 1 renders in the request thread
+RASTER_WORKERS = getattr(settings, "REPORT_RASTER_WORKERS", os.cpu_count() or 1)
+RASTER_MIN_PAGES = getattr(settings, "REPORT_RASTER_MIN_PAGES", DEFAULT_MIN_PAGES)
+
+# Drop blank and repeated pages before they are encoded, see page_filter
+FILTER_PAGES = getattr(settings, "REPORT_FILTER_PAGES", True)
+
+# Image format/DPI/size used for rasterized pages, see encoding.ENCODING_PROFILES
+ENCODING_PROFILE = get_encoding_profile(getattr(settings, "REPORT_ENCODING_PROFILE", None), default="png-300")
+
+REPORT_CACHE_DIR = getattr(settings, "REPORT_CACHE_DIR", DEFAULT_CACHE_DIR)
+report_cache = ReportCache(os.path.join(REPORT_CACHE_DIR, "reports"))
+page_cache = ReportCache(os.path.join(REPORT_CACHE_DIR, "pages"))
+reduce_cache = ReportCache(os.path.join(REPORT_CACHE_DIR, "reduce"))
+
+# Background report jobs: SQLite file and number of worker threads per process
+REPORT_JOBS_DB = getattr(settings, "REPORT_JOBS_DB", DEFAULT_DB_PATH)
+REPORT_JOB_WORKERS = getattr(settings, "REPORT_JOB_WORKERS", DEFAULT_WORKERS)
+
+render_seconds = registry.histogram("report_render_seconds", "Time to produce one page, by source (text or raster)")
+encode_seconds = registry.histogram("report_encode_seconds", "Time to encode one page for the model")
+encoded_bytes = registry.histogram("report_encoded_bytes", "Size of one encoded page, by mime type", BYTES_BUCKETS)
+parse_failures = registry.counter("report_parse_failures_total", "Model responses without a usable analysis")
+reduce_seconds = registry.histogram("report_reduce_seconds", "Time to merge page analyses into one report")
+report_pages = registry.counter("report_pages_total", "Report pages by outcome (analyzed, cached, failed, skipped)")
+
+# Build the report model and open its connection when the worker loads this module
+if getattr(settings, "GEMINI_WARM_UP", False):
+    warm_up_in_background(['gemini-1.5-flash'], os.getenv("GEMINI_API_KEY"))
+
 def configure_gemini():
-    """Configure Gemini API"""
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    return model
+    """Get the shared Gemini model for report analysis"""
+    return get_model('gemini-1.5-flash', os.getenv("GEMINI_API_KEY"))
+
+def iter_pdf_pages(pdf_bytes, dpi=300, text_layer=False, workers=None):
+    """Render PDF pages one at a time using PyMuPDF
+
+    The document is opened eagerly so a broken upload fails here; the pages
+    themselves are only rendered as the returned generator is consumed.
+    With text_layer=True, pages that carry enough text are yielded as that
+    text (a str) and only scanned or image-only pages are rasterized.
+    With workers > 1, larger documents are rasterized by a process pool.
+    """
+    pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    return _render_pages(pdf_document, pdf_bytes, dpi, text_layer, workers)
+
+def _render_pages(pdf_document, pdf_bytes, dpi, text_layer, workers):
+    rendered = None
+    try:
+        # Pick out text-layer pages first, that is cheap next to rendering
+        texts = {}
+        raster_pages = []
+        for page_num in range(pdf_document.page_count):
+            text = None
+            if text_layer:
+                with span(render_seconds, "render", source="text"):
+                    text = extract_text_layer(pdf_document[page_num])
+            if text is None:
+                raster_pages.append(page_num)
+            else:
+                texts[page_num] = text
+
+        if workers and workers > 1 and len(raster_pages) >= RASTER_MIN_PAGES:
+            # Render no further ahead than the requests in flight can take, plus a page per worker
+            lookahead = (GEMINI_MAX_IN_FLIGHT or DEFAULT_MAX_IN_FLIGHT) + workers
+            rendered = render_pages_parallel(pdf_bytes, raster_pages, dpi, workers, lookahead=lookahead)
+        else:
+            rendered = _render_serial(pdf_document, raster_pages, dpi)
+
+        for page_num in range(pdf_document.page_count):
+            if page_num in texts:
+                yield texts.pop(page_num)
+            else:
+                # The parallel renderer works ahead, so this is the time spent waiting on it
+                with span(render_seconds, "render", source="raster"):
+                    _, image = next(rendered)
+                yield image
+    finally:
+        if rendered is not None:
+            rendered.close()
+        pdf_document.close()
+
+def _render_serial(pdf_document, page_numbers, dpi):
+    for page_num in page_numbers:
+        page = pdf_document[page_num]
+        # Convert to image (300 DPI for good quality)
+        pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
+
+        # Convert to PIL Image
+        yield page_num, Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+def pdf_page_count(pdf_bytes):
+    """Number of pages in a PDF without rendering any"""
+    pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return pdf_document.page_count
+    finally:
+        pdf_document.close()
 
 def pdf_to_images(pdf_file):
     """Convert PDF to images using PyMuPDF"""
     try:
         # Read PDF content
         pdf_bytes = pdf_file.read()
-        
-        # Open PDF document
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        images = []
-        
-        # Process each page
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            # Convert to image (300 DPI for good quality)
-            pix = page.get_pixmap(matrix=fitz.Matrix(300/72, 300/72))
-            
-            # Convert to PIL Image
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            images.append(img)
-        
-        pdf_document.close()
-        return images
-        
+        return list(iter_pdf_pages(pdf_bytes))
+
     except Exception as e:
         raise Exception(f"Error processing PDF: {str(e)}")
 
-def get_gemini_response(model, images, language):
-    """Get consolidated analysis from Gemini for all images"""
+def encode_images(images, profile=None):
+    """Encode images as parts as they are consumed, PNG unless a profile is given
+
+    Text pages from iter_pdf_pages(text_layer=True) become text/plain parts.
+    """
+    for image in images:
+        with span(encode_seconds, "encode"):
+            part = encode_page(image, profile)
+        encoded_bytes.observe(len(part["data"]), mime_type=part["mime_type"])
+        yield part
+
+def encode_page(image, profile=None):
+    """Model part for one rendered page or page text"""
+    if isinstance(image, str):
+        return {
+            "mime_type": "text/plain",
+            "data": image.encode("utf-8")
+        }
+
+    if profile is not None:
+        return encode_image(image, profile)
+
+    img_byte_arr = io.BytesIO()
+    image.save(img_byte_arr, format='PNG')
+    return {
+        "mime_type": "image/png",
+        "data": img_byte_arr.getvalue()
+    }
+
+def build_report_prompt(language):
+    """Prompt asking for the JSON analysis of one report page"""
+    return f"""
+    Summarize the following medical report in {language} in a clear, concise and easy-to-understand way:
+
+    Please analyze these medical report pages and provide a simplified summary that a non-medical expert can understand.
+    Focus on:
+    1. Main medical issues or concerns
+    2. Key findings from tests and examinations
+    3. Treatment plan and next steps
+    4. Important follow-up actions
+    5. Use simple, plain language without technical terms
+
+    Provide the response in this JSON format:
+    {{
+        "test_results": {{
+            "key_findings": [
+                "List main test results in simple terms",
+                "Explain what each result means for health"
+            ],
+            "abnormal_values": [
+                "List any concerning results",
+                "Explain why they are important"
+            ],
+            "normal_values": [
+                "List healthy/normal results",
+                "Explain what's good about them"
+            ]
+        }},
+        "health_assessment": {{
+            "overall_status": "Simple explanation of overall health status",
+            "areas_of_concern": [
+                "List main health concerns in simple terms",
+                "Explain why each is important"
+            ],
+            "positive_indicators": [
+                "List good health indicators",
+                "Explain why they're positive"
+            ]
+        }},
+        "recommendations": {{
+            "immediate_actions": [
+                "List urgent steps to take",
+                "Explain why they're important"
+            ],
+            "follow_up_tests": [
+                "List recommended future tests",
+                "Explain why they're needed"
+            ],
+            "lifestyle_changes": [
+                "List suggested lifestyle improvements",
+                "Explain how they will help"
+            ]
+        }},
+        "summary": "A brief, simple explanation of the overall report in 2-3 sentences"
+    }}
+    """
+
+def page_content(image_part):
+    """Model input for one encoded page"""
+    if image_part["mime_type"] == "text/plain":
+        # Text layer: send it inline, laid out one row per line
+        page_text = image_part["data"].decode("utf-8")
+        return f"Report page text (table columns separated by |):\n{page_text}"
+    return image_part
+
+def parse_response(response, page_numbers):
+    """Validated analyses for page_numbers from the model's JSON answer
+
+    Fenced or chatty output is recovered locally instead of dropping the
+    pages; only a response without any usable JSON raises.
+    """
+    if len(page_numbers) == 1:
+        return [parse_page(response.text)]
+    return [validate_page(page) for page in split_batch_response(parse_batch(response.text), page_numbers)]
+
+def lookup_batch(batch, language):
+    """Serve what we can of a batch from the page cache
+
+    Returns (analyses, to_send): analyses maps page numbers to cached
+    results, to_send lists (page_number, image_part, cache_key) for the
+    pages that still need the model.
+    """
+    analyses = {}
+    to_send = []
+    for page_number, image_part in batch:
+        cache_key = page_key(image_part["data"], language, PROMPT_VERSION)
+        cached = page_cache.get(cache_key)
+        if cached is not None:
+            analyses[page_number] = cached
+        else:
+            to_send.append((page_number, image_part, cache_key))
+    return analyses, to_send
+
+def batch_request(prompt, to_send):
+    """Model content analyzing every page in to_send with one request"""
+    if len(to_send) == 1:
+        return [prompt, page_content(to_send[0][1])]
+    content = [batch_prompt(prompt, len(to_send))]
+    for page_number, image_part, _ in to_send:
+        content.extend([f"Page {page_number}:", page_content(image_part)])
+    return content
+
+def store_batch(response, to_send, analyses):
+    """Attribute a model response to its pages and cache each page"""
+    page_numbers = [page_number for page_number, _, _ in to_send]
     try:
-        # Convert all images to byte arrays
-        image_parts = []
-        for image in images:
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='PNG')
-            image_parts.append({
-                "mime_type": "image/png",
-                "data": img_byte_arr.getvalue()
-            })
-        
-        prompt = f"""
-        Summarize the following medical report in {language} in a clear, concise and easy-to-understand way:
-
-        Please analyze these medical report images and provide a simplified summary that a non-medical expert can understand.
-        Focus on:
-        1. Main medical issues or concerns
-        2. Key findings from tests and examinations
-        3. Treatment plan and next steps
-        4. Important follow-up actions
-        5. Use simple, plain language without technical terms
-
-        Provide the response in this JSON format:
-        {{
-            "test_results": {{
-                "key_findings": [
-                    "List main test results in simple terms",
-                    "Explain what each result means for health"
-                ],
-                "abnormal_values": [
-                    "List any concerning results",
-                    "Explain why they are important"
-                ],
-                "normal_values": [
-                    "List healthy/normal results",
-                    "Explain what's good about them"
-                ]
-            }},
-            "health_assessment": {{
-                "overall_status": "Simple explanation of overall health status",
-                "areas_of_concern": [
-                    "List main health concerns in simple terms",
-                    "Explain why each is important"
-                ],
-                "positive_indicators": [
-                    "List good health indicators",
-                    "Explain why they're positive"
-                ]
-            }},
-            "recommendations": {{
-                "immediate_actions": [
-                    "List urgent steps to take",
-                    "Explain why they're important"
-                ],
-                "follow_up_tests": [
-                    "List recommended future tests",
-                    "Explain why they're needed"
-                ],
-                "lifestyle_changes": [
-                    "List suggested lifestyle improvements",
-                    "Explain how they will help"
-                ]
-            }},
-            "summary": "A brief, simple explanation of the overall report in 2-3 sentences"
-        }}
-        """
-
-        # Process each image and combine results
-        responses = []
-        for image_part in image_parts:
+        new_analyses = parse_response(response, page_numbers)
+    except Exception:
+        parse_failures.inc()
+        raise
+    for (page_number, _, cache_key), page_analysis in zip(to_send, new_analyses):
+        page_cache.set(cache_key, page_analysis)
+        analyses[page_number] = page_analysis
+
+def numbered_parts(images, profile, skipped_pages):
+    """Encoded (page_number, part) pairs of the pages worth sending
+
+    With REPORT_FILTER_PAGES, blank and repeated pages are dropped before
+    they are encoded and listed in skipped_pages; the pairs keep each
+    page's number in the uploaded document.
+    """
+    if not FILTER_PAGES:
+        return enumerate(encode_images(images, profile), 1)
+    page_numbers = []
+    image_parts = encode_images(filter_pages(images, page_numbers, skipped_pages), profile)
+    return ((page_numbers[index], part) for index, part in enumerate(image_parts))
+
+def numbered_batches(image_parts, batch_size, batch_page_numbers):
+    """Pack (page_number, part) pairs into requests of up to batch_size pages within the byte budget
+
+    The page numbers of every batch produced are appended to batch_page_numbers.
+    """
+    max_pages = batch_size if batch_size is not None else GEMINI_BATCH_PAGES
+    for batch in batch_pages(image_parts, max_pages, GEMINI_BATCH_MAX_BYTES):
+        batch_page_numbers.append([page_number for page_number, _ in batch])
+        yield batch
+
+def collect_pages(batch_page_numbers, batch_results, failed_batches):
+    """Flatten batch results back to one analysis per page, keeping each page attributable"""
+    responses = []
+    for page_numbers, batch_result in zip(batch_page_numbers, batch_results):
+        responses.extend(batch_result or [None] * len(page_numbers))
+    failed_pages = [
+        {"page": page_number, "error": failure["error"]}
+        for failure in failed_batches
+        for page_number in batch_page_numbers[failure["page"] - 1]
+    ]
+    return responses, failed_pages
+
+def report_skipped(progress, skipped_pages):
+    """Count skipped pages and mark them in the progress callback"""
+    report_pages.inc(len(skipped_pages), outcome="skipped")
+    if progress is not None and skipped_pages:
+        progress([page["page"] for page in skipped_pages], "skipped")
+
+def report_progress(progress, batch, status):
+    """Tell a progress callback which pages a batch covered"""
+    if status == "failed":
+        report_pages.inc(len(batch), outcome="failed")
+    if progress is not None:
+        progress([page_number for page_number, _ in batch], status)
+
+def get_gemini_response(model, images, language, max_in_flight=None, profile=None, batch_size=None,
+                        progress=None):
+    """Get consolidated analysis from Gemini for all images
+
+    images can be a list or a generator such as iter_pdf_pages(); pages are
+    encoded and sent as they arrive, with at most max_in_flight requests held
+    at once. Each request carries up to batch_size pages. Blank and repeated
+    pages are not sent, see numbered_parts. progress, if given, is called
+    with (page_numbers, "done", "failed" or "skipped") as pages finish.
+    """
+    try:
+        # Encode lazily so rendering, encoding and the model calls overlap
+        skipped_pages = []
+        image_parts = numbered_parts(images, profile, skipped_pages)
+        prompt = build_report_prompt(language)
+
+        def analyze_batch(batch):
             try:
-                response = model.generate_content([prompt, image_part])
-                try:
-                    json_response = json.loads(response.text)
-                    responses.append(json_response)
-                except json.JSONDecodeError:
-                    cleaned_response = response.text.strip()
-                    if cleaned_response.startswith("```json"):
-                        cleaned_response = cleaned_response[7:-3]
-                    responses.append(json.loads(cleaned_response))
+                analyses, to_send = lookup_batch(batch, language)
+                if to_send:
+                    response = model.generate_content(
+                        batch_request(prompt, to_send),
+                        generation_config=generation_config(batch=len(to_send) > 1)
+                    )
+                    store_batch(response, to_send, analyses)
             except Exception as e:
-                continue
+                logger.warning("Report pages %s failed: %s", [page_number for page_number, _ in batch], e)
+                report_progress(progress, batch, "failed")
+                raise
+            report_pages.inc(len(batch) - len(to_send), outcome="cached")
+            report_pages.inc(len(to_send), outcome="analyzed")
+            report_progress(progress, batch, "done")
+            return [analyses[page_number] for page_number, _ in batch]
+
+        # Process the batches concurrently, results come back in page order
+        if max_in_flight is None:
+            max_in_flight = GEMINI_MAX_IN_FLIGHT
+        batch_page_numbers = []
+        batches = numbered_batches(image_parts, batch_size, batch_page_numbers)
+        batch_results, failed_batches = dispatch_pages(analyze_batch, batches, max_in_flight)
+        responses, failed_pages = collect_pages(batch_page_numbers, batch_results, failed_batches)
+        report_skipped(progress, skipped_pages)
 
         # Combine all responses into a single analysis
-        combined_analysis = combine_analyses(responses)
+        combined_analysis = combine_analyses(responses, model, language)
+        combined_analysis["failed_pages"] = failed_pages
+        combined_analysis["skipped_pages"] = skipped_pages
+        return combined_analysis
+
+    except Exception as e:
+        logger.exception("Gemini analysis failed")
+        raise Exception(f"Error in Gemini analysis: {str(e)}")
+
+async def aget_gemini_response(model, images, language, max_in_flight=None, profile=None, batch_size=None,
+                               progress=None):
+    """Async get_gemini_response for ASGI views
+
+    Model calls use generate_content_async, so waiting on Gemini holds no
+    thread. Rendering, encoding and cache I/O are CPU or disk bound and run
+    in worker threads.
+    """
+    try:
+        skipped_pages = []
+        image_parts = numbered_parts(images, profile, skipped_pages)
+        prompt = build_report_prompt(language)
+
+        async def analyze_batch(batch):
+            try:
+                analyses, to_send = await asyncio.to_thread(lookup_batch, batch, language)
+                if to_send:
+                    response = await model.generate_content_async(
+                        batch_request(prompt, to_send),
+                        generation_config=generation_config(batch=len(to_send) > 1)
+                    )
+                    await asyncio.to_thread(store_batch, response, to_send, analyses)
+            except Exception as e:
+                logger.warning("Report pages %s failed: %s", [page_number for page_number, _ in batch], e)
+                await asyncio.to_thread(report_progress, progress, batch, "failed")
+                raise
+            report_pages.inc(len(batch) - len(to_send), outcome="cached")
+            report_pages.inc(len(to_send), outcome="analyzed")
+            await asyncio.to_thread(report_progress, progress, batch, "done")
+            return [analyses[page_number] for page_number, _ in batch]
+
+        if max_in_flight is None:
+            max_in_flight = GEMINI_MAX_IN_FLIGHT
+        batch_page_numbers = []
+        batches = numbered_batches(image_parts, batch_size, batch_page_numbers)
+        batch_results, failed_batches = await adispatch_pages(analyze_batch, batches, max_in_flight)
+        responses, failed_pages = collect_pages(batch_page_numbers, batch_results, failed_batches)
+        await asyncio.to_thread(report_skipped, progress, skipped_pages)
+
+        # The reduce stage makes blocking model calls from its own thread pool
+        combined_analysis = await asyncio.to_thread(combine_analyses, responses, model, language)
+        combined_analysis["failed_pages"] = failed_pages
+        combined_analysis["skipped_pages"] = skipped_pages
         return combined_analysis
 
     except Exception as e:
+        logger.exception("Gemini analysis failed")
         raise Exception(f"Error in Gemini analysis: {str(e)}")
 
-def combine_analyses(responses):
-    """Combine multiple analyses into one comprehensive report"""
+def combine_analyses(responses, model=None, language="English"):
+    """Combine multiple analyses into one comprehensive report
+
+    Page analyses are merged in a tree, see reduce.reduce_tree: list fields
+    are joined with near-duplicates merged, and the model writes the overall
+    status and summary of every merged group from those of its parts.
+    """
     combined = {
         "test_results": {
             "key_findings": [],
@@ -204,52 +605,24 @@ def combine_analyses(responses):
         "summary": ""
     }
 
-    for response in responses:
-        if not response:
-            continue
-
-        # Combine test results
-        for category in ["key_findings", "abnormal_values", "normal_values"]:
-            combined["test_results"][category].extend(
-                response.get("test_results", {}).get(category, [])
-            )
-
-        # Update health assessment
-        assessment = response.get("health_assessment", {})
-        if assessment.get("overall_status"):
-            combined["health_assessment"]["overall_status"] = assessment["overall_status"]
-        combined["health_assessment"]["areas_of_concern"].extend(
-            assessment.get("areas_of_concern", [])
-        )
-        combined["health_assessment"]["positive_indicators"].extend(
-            assessment.get("positive_indicators", [])
-        )
+    pages = [response for response in responses if response]
+    if not pages:
+        return combined
 
-        # Combine recommendations
-        for category in ["immediate_actions", "follow_up_tests", "lifestyle_changes"]:
-            combined["recommendations"][category].extend(
-                response.get("recommendations", {}).get(category, [])
-            )
-
-    # Remove duplicates while preserving order
-    for category in combined["test_results"]:
-        combined["test_results"][category] = list(dict.fromkeys(
-            combined["test_results"][category]
-        ))
-    for category in combined["health_assessment"]:
-        if isinstance(combined["health_assessment"][category], list):
-            combined["health_assessment"][category] = list(dict.fromkeys(
-                combined["health_assessment"][category]
-            ))
-    for category in combined["recommendations"]:
-        combined["recommendations"][category] = list(dict.fromkeys(
-            combined["recommendations"][category]
-        ))
-
-    combined["summary"] = "Complete analysis of all report pages combined."
+    with span(reduce_seconds, "reduce"):
+        reduced = reduce_tree(
+            pages,
+            lambda children: merge_analyses(children, model, language),
+            cache=reduce_cache,
+            key_parts=(language, PROMPT_VERSION)
+        )
+    for section in ["test_results", "health_assessment", "recommendations"]:
+        combined[section].update(reduced.get(section, {}))
+    combined["summary"] = reduced.get("summary", "")
     return combined
 
 @csrf_exempt
+@timed_view(request_seconds, "analyze_medical_report", METRICS_SERVER_TIMING)
 def analyze_medical_report(request):
     """Django view function for medical report analysis"""
     if request.method == 'GET':
@@ -264,18 +637,107 @@ def analyze_medical_report(request):
             if not pdf_file:
                 return JsonResponse({'error': 'No PDF file provided'}, status=400)
             
+            # Serve repeated uploads from the cache before doing any work
+            pdf_bytes = pdf_file.read()
+            cache_key = report_key(pdf_bytes, language, PROMPT_VERSION)
+            analysis = report_cache.get(cache_key)
+            if analysis is not None:
+                return JsonResponse({
+                    'success': True,
+                    'analysis': analysis,
+                    'cached': True
+                })
+            
             # Configure Gemini
             model = configure_gemini()
             
-            # Convert PDF to images
-            images = pdf_to_images(pdf_file)
+            # Render pages lazily; each one is encoded and sent as it is produced
+            try:
+                images = iter_pdf_pages(
+                    pdf_bytes,
+                    dpi=ENCODING_PROFILE["dpi"],
+                    text_layer=USE_TEXT_LAYER,
+                    workers=RASTER_WORKERS
+                )
+            except Exception as e:
+                raise Exception(f"Error processing PDF: {str(e)}")
             
             # Get analysis from Gemini
-            analysis = get_gemini_response(model, images, language)
+            analysis = get_gemini_response(model, images, language, profile=ENCODING_PROFILE)
+            
+            # Partial analyses are not cached so a retry can fill the gaps
+            if not analysis["failed_pages"]:
+                report_cache.set(cache_key, analysis)
+            
+            return JsonResponse({
+                'success': True,
+                'analysis': analysis,
+                'cached': False
+            })
+            
+        except Exception as e:
+            return JsonResponse({
+                'success': False,
+                'error': str(e)
+            }, status=500)
+
+@csrf_exempt
+@timed_view(request_seconds, "aanalyze_medical_report", METRICS_SERVER_TIMING)
+async def aanalyze_medical_report(request):
+    """Async analyze_medical_report for ASGI deployments
+
+    File handling, cache I/O and PDF rendering run in worker threads and
+    the model calls are awaited, so one ASGI worker can hold many uploads
+    in flight.
+    """
+    if request.method == 'GET':
+        return await sync_to_async(render)(request, 'medical_report/upload.html')
+    
+    elif request.method == 'POST':
+        try:
+            # Parsing the multipart body may touch spooled temp files
+            pdf_file, language = await sync_to_async(
+                lambda: (request.FILES.get('pdf_file'), request.POST.get('language', 'English')),
+                thread_sensitive=False
+            )()
+            
+            if not pdf_file:
+                return JsonResponse({'error': 'No PDF file provided'}, status=400)
+            
+            # Serve repeated uploads from the cache before doing any work
+            pdf_bytes = await asyncio.to_thread(pdf_file.read)
+            cache_key = report_key(pdf_bytes, language, PROMPT_VERSION)
+            analysis = await asyncio.to_thread(report_cache.get, cache_key)
+            if analysis is not None:
+                return JsonResponse({
+                    'success': True,
+                    'analysis': analysis,
+                    'cached': True
+                })
+            
+            model = configure_gemini()
+            
+            try:
+                images = await asyncio.to_thread(
+                    iter_pdf_pages,
+                    pdf_bytes,
+                    dpi=ENCODING_PROFILE["dpi"],
+                    text_layer=USE_TEXT_LAYER,
+                    workers=RASTER_WORKERS
+                )
+            except Exception as e:
+                raise Exception(f"Error processing PDF: {str(e)}")
+            
+            analysis = await aget_gemini_response(model, images, language, profile=ENCODING_PROFILE)
+            
+            # Partial analyses are not cached so a retry can fill the gaps
+            if not analysis["failed_pages"]:
+                await asyncio.to_thread(report_cache.set, cache_key, analysis)
             
             return JsonResponse({
                 'success': True,
-                'analysis': analysis
+                'analysis': analysis,
+                'cached': False
             })
             
         except Exception as e:
@@ -283,3 +745,100 @@ def analyze_medical_report(request):
                 'success': False,
                 'error': str(e)
             }, status=500)
+
+def run_report_job(job, progress):
+    """Analyze one queued upload; runs on a report job worker thread"""
+    pdf_bytes = job["upload"]
+    language = job["payload"]["language"]
+
+    cache_key = report_key(pdf_bytes, language, PROMPT_VERSION)
+    analysis = report_cache.get(cache_key)
+    if analysis is not None:
+        return {'analysis': analysis, 'cached': True}
+
+    model = configure_gemini()
+    try:
+        images = iter_pdf_pages(
+            pdf_bytes,
+            dpi=ENCODING_PROFILE["dpi"],
+            text_layer=USE_TEXT_LAYER,
+            workers=RASTER_WORKERS
+        )
+    except Exception as e:
+        raise Exception(f"Error processing PDF: {str(e)}")
+    progress.total(pdf_page_count(pdf_bytes))
+
+    analysis = get_gemini_response(model, images, language, profile=ENCODING_PROFILE, progress=progress.pages)
+    if not analysis["failed_pages"]:
+        report_cache.set(cache_key, analysis)
+    return {'analysis': analysis, 'cached': False}
+
+report_jobs = JobQueue(run_report_job, db_path=REPORT_JOBS_DB, workers=REPORT_JOB_WORKERS)
+
+@csrf_exempt
+def submit_report_job(request):
+    """Queue a medical report for analysis and return its job id right away"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST a PDF file'}, status=405)
+
+    pdf_file = request.FILES.get('pdf_file')
+    language = request.POST.get('language', 'English')
+    if not pdf_file:
+        return JsonResponse({'error': 'No PDF file provided'}, status=400)
+
+    try:
+        job_id = report_jobs.submit({'language': language}, pdf_file.read())
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+    return JsonResponse({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued'
+    }, status=202)
+
+def report_job_status(request, job_id):
+    """Job status with per-page progress, for polling"""
+    report_jobs.start()
+    job = report_jobs.get(job_id)
+    if job is None:
+        return JsonResponse({'error': 'Unknown job'}, status=404)
+    return JsonResponse(job)
+
+def report_job_result(request, job_id):
+    """Analysis of a finished job; 202 while it is still queued or running"""
+    job = report_jobs.get(job_id)
+    if job is None:
+        return JsonResponse({'error': 'Unknown job'}, status=404)
+    if job['status'] == 'failed':
+        return JsonResponse({'success': False, 'error': job['error']}, status=500)
+    if job['status'] != 'done':
+        return JsonResponse({'success': False, 'status': job['status']}, status=202)
+
+    result = report_jobs.result(job_id)
+    return JsonResponse({
+        'success': True,
+        'analysis': result['analysis'],
+        'cached': result['cached']
+    })
+
+def report_job_metrics(request):
+    """Queue depth and job counts for monitoring"""
+    return JsonResponse(report_jobs.stats())
+
+def model_call_metrics(request):
+    """Throttled, retried and abandoned Gemini calls and the current concurrency limit"""
+    return JsonResponse(default_limiter.stats())
+
+registry.register_collector(stats_collector("gemini_limiter", default_limiter.stats))
+registry.register_collector(stats_collector("report_jobs", report_jobs.stats))
+registry.register_collector(stats_collector("report_cache", report_cache.stats))
+registry.register_collector(stats_collector("page_cache", page_cache.stats))
+registry.register_collector(stats_collector("reduce_cache", reduce_cache.stats))
+registry.register_collector(stats_collector("chat_response_cache", response_cache.stats))
+
+def metrics(request):
+    """All metrics in the Prometheus text format, for scraping"""
+    if not enabled():
+        return HttpResponse("Metrics are disabled", status=404, content_type="text/plain")
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")